@@ -0,0 +1,54 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# how bgraph's graph construction scales with --jobs.  Builds the graph
+# for the given refs from scratch (no cache) with each job count,
+# checks every build gives the same graph as the serial one, and
+# reports the speedup.
+
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import refs
+from graphstore import GraphStore
+
+parser = argparse.ArgumentParser(description="time parallel graph construction for several job counts",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-r", "--repodir", default=".", help="base of repo")
+parser.add_argument("-R", "--remote", action="store_true", help="use remote branches (of all remotes) too")
+parser.add_argument("-b", "--bounded", action="store_true", help="only read back to the merge-base, like bgraph --nocache")
+parser.add_argument("-j", "--jobs", default="1,2,4,8", help="comma separated job counts")
+parser.add_argument("-n", "--repeat", type=int, default=3, help="best of this many runs")
+args = parser.parse_args()
+
+
+# parent sha of every sha, which is what has to match between builds
+def shape(store):
+    return {store.hexsha(idx): (None if store.parents[idx] < 0 else store.hexsha(store.parents[idx])) for idx in range(len(store))}
+
+
+prefixes = [refs.HEADS, refs.REMOTES] if args.remote else [refs.HEADS]
+tips = [ref.hexsha for ref in refs.readRefs(args.repodir, prefixes)]
+print("{} tips, {} cores".format(len(tips), os.cpu_count()))
+print("{:>5} {:>10} {:>10} {:>8} {:>6}".format("jobs", "commits", "best(s)", "speedup", "same"))
+serial = None
+differ = False
+for jobs in [int(x) for x in args.jobs.split(",")]:
+    best = None
+    for i in range(args.repeat):
+        store = GraphStore()
+        store.jobs = jobs
+        start = timer()
+        store.readHistory(args.repodir, tips, bounded=args.bounded)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if serial is None:
+        serial = (best, shape(store))
+    same = shape(store) == serial[1]
+    differ = differ or not same
+    print("{:5} {:10} {:10.3f} {:7.2f}x {:>6}".format(jobs, len(store), best, serial[0] / best, "yes" if same else "NO"))
+if differ:
+    print("The graphs differ")
+    sys.exit(1)
@@ -0,0 +1,66 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# compare the two ways bgraph can find the files a branch changed:
+# union of every commit's files (--segments union) against a single
+# diff from the split point to the tip (--segments tree)
+
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import gitstream
+from filechanges import FileChanges
+
+parser = argparse.ArgumentParser(description="time per-commit union vs tree diff for branch segments",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-r", "--repodir", default=".", help="base of repo")
+parser.add_argument("-b", "--base", default="main", help="branch the others split from")
+parser.add_argument("-n", "--repeat", type=int, default=3, help="best of this many runs")
+parser.add_argument("branches", nargs='+', help="long-lived branches to measure")
+args = parser.parse_args()
+repodir = args.repodir
+
+
+# commits on branch's first-parent chain that aren't in base, newest
+# first, and the commit the segment split from
+def segment(branch):
+    chain = list(gitstream.firstParents(repodir, [branch, "^{}".format(args.base)]))
+    if len(chain) == 0:
+        return ([], None)
+    return (chain, chain[-1][2][0] if len(chain[-1][2]) > 0 else None)
+
+
+def union(chain):
+    changes = FileChanges(repodir)
+    changes.prefetch([(hexsha, parents[0] if len(parents) > 0 else None) for (hexsha, date, parents) in chain])
+    files = set()
+    for (hexsha, date, parents) in chain:
+        files.update(changes.files[hexsha])
+    return files
+
+
+def tree(chain, split):
+    return set(FileChanges(repodir).between(split, chain[0][0]))
+
+
+def best(fn, *fnargs):
+    times = []
+    for i in range(args.repeat):
+        start = timer()
+        result = fn(*fnargs)
+        times.append(timer() - start)
+    return (min(times), result)
+
+
+print("{:30} {:>8} {:>8} {:>8} {:>10} {:>10} {:>8}".format("branch", "commits", "union", "tree", "union(s)", "tree(s)", "speedup"))
+for branch in args.branches:
+    (chain, split) = segment(branch)
+    if split is None:
+        print("{:30} nothing to compare against {}".format(branch, args.base))
+        continue
+    (utime, ufiles) = best(union, chain)
+    (ttime, tfiles) = best(tree, chain, split)
+    print("{:30} {:8} {:8} {:8} {:10.4f} {:10.4f} {:7.1f}x".format(branch, len(chain), len(ufiles), len(tfiles), utime, ttime,
+                                                                   utime / ttime if ttime > 0 else 0))
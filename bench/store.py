@@ -0,0 +1,94 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# memory and build time of bgraph's graph: the old dict of Node objects
+# (one GitPython commit, parent, depth and children list per commit)
+# against the array backed GraphStore
+
+import argparse
+import os
+import sys
+import tracemalloc
+from timeit import default_timer as timer
+from git import Repo, Commit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import gitstream
+from graphstore import GraphStore
+
+parser = argparse.ArgumentParser(description="compare memory and build time of the old Node dict and GraphStore",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-r", "--repodir", default=".", help="base of repo")
+parser.add_argument("refs", nargs='*', default=["--branches"], help="refs to load (default: all local branches)")
+args = parser.parse_args()
+repo = Repo(args.repodir)
+
+
+# the layout bgraph used to have
+class OldNode:
+    all = {}
+
+    def __init__(self, commit):
+        self.name = None
+        self.commit = commit
+        self.parent = None
+        self.depth = None
+        self.children = []
+        OldNode.all[commit.hexsha] = self
+
+
+def oldBuild(lines):
+    for (hexsha, date, parents) in lines:
+        node = OldNode.all.get(hexsha) or OldNode(Commit(repo, bytes.fromhex(hexsha)))
+        if len(parents) > 0:
+            parent = OldNode.all.get(parents[0]) or OldNode(Commit(repo, bytes.fromhex(parents[0])))
+            node.parent = parent
+            parent.children.append(node)
+    for node in OldNode.all.values():
+        todo = []
+        while node is not None and node.depth is None:
+            todo.append(node)
+            node = node.parent
+        depth = -1 if node is None else node.depth
+        for node in reversed(todo):
+            depth += 1
+            node.depth = depth
+    return OldNode.all
+
+
+def newBuild(lines):
+    store = GraphStore()
+    pending = []
+    for (hexsha, date, parents) in lines:
+        idx = store.add(hexsha, date)
+        if len(parents) > 0:
+            pending.append((idx, parents[0]))
+    for (idx, parent) in pending:
+        store.parents[idx] = store.lookup(parent)
+    store.fillDepths()
+    store.buildChildren()
+    return store
+
+
+# time without tracemalloc, since tracing every allocation slows the
+# object heavy build far more than the array one
+def measure(build, lines):
+    OldNode.all = {}
+    start = timer()
+    graph = build(lines)
+    elapsed = timer() - start
+    graph = None
+    OldNode.all = {}
+    tracemalloc.start()
+    graph = build(lines)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (len(graph), elapsed, current, peak)
+
+
+tips = [line for line in gitstream.gitLines(args.repodir, ["rev-parse"] + args.refs)]
+lines = list(gitstream.firstParents(args.repodir, tips))
+print("{} commits from {} refs".format(len(lines), len(tips)))
+print("{:12} {:>10} {:>10} {:>12} {:>12}".format("graph", "commits", "build(s)", "kept(MB)", "peak(MB)"))
+for (name, build) in (("Node dict", oldBuild), ("GraphStore", newBuild)):
+    (count, elapsed, current, peak) = measure(build, lines)
+    print("{:12} {:10} {:10.3f} {:12.1f} {:12.1f}".format(name, count, elapsed, current / 1e6, peak / 1e6))
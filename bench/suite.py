@@ -0,0 +1,112 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# end to end timings of bgraph and findcommon on synthetic repos of
+# several sizes (see synthrepo.py), so a change can be checked for
+# regressions without a big real repo at hand.  Repos are built once
+# into --workdir and reused, since the same parameters always give the
+# same repo.  Each script runs with --profile-json and the per phase
+# times go both to a table and, one JSON object per run, to --output
+# for comparing later.  bgraph writes tree.html and tree-data/ next to
+# itself like it always does.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import synthrepo
+
+scriptDir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+parser = argparse.ArgumentParser(description="time bgraph and findcommon on synthetic repos",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-s", "--sizes", default="1000x10,10000x50,100000x200",
+                    help="comma separated COMMITSxBRANCHES repo sizes")
+parser.add_argument("-l", "--length", type=int, default=20, help="commits on each branch")
+parser.add_argument("-m", "--merge-density", type=float, default=0.2, help="share of branches merged back into main")
+parser.add_argument("-f", "--files-per-commit", type=int, default=2, help="files each commit changes")
+parser.add_argument("--files", type=int, default=500, help="files in each repo")
+parser.add_argument("--seed", type=int, default=1, help="random seed for the repos")
+parser.add_argument("-n", "--repeat", type=int, default=3, help="best of this many runs")
+parser.add_argument("-d", "--workdir", default=os.path.join(tempfile.gettempdir(), "gitutils-bench"), help="where the repos are kept")
+parser.add_argument("-o", "--output", default="", help="append results to this file as JSON Lines")
+parser.add_argument("--label", default="", help="label for the results (default: the current commit of this tree)")
+args = parser.parse_args()
+
+# (name, script, arguments, whether to drop the graph cache first)
+# for each run, and the phases to show for each script
+RUNS = [
+    ("bgraph cold", "bgraph.py", [], True),
+    ("bgraph warm", "bgraph.py", [], False),
+    ("bgraph nocache", "bgraph.py", ["--nocache"], False),
+    ("bgraph merges", "bgraph.py", ["-m"], False),
+    ("bgraph export", "bgraph.py", ["-e", os.devnull], False),
+    ("findcommon cold", "findcommon.py", ["main", "b0"], True),
+    ("findcommon warm", "findcommon.py", ["main", "b0"], False),
+]
+COLUMNS = {
+    "bgraph.py": ["history", "fork point", "text", "html", "export"],
+    "findcommon.py": ["history", "lca", "output"],
+}
+
+
+def label():
+    if args.label != "":
+        return args.label
+    proc = subprocess.run(["git", "-C", scriptDir, "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE, universal_newlines=True)
+    return proc.stdout.strip()
+
+
+# build the repo for commits and branches unless it's already there
+def repo(commits, branches):
+    path = os.path.join(args.workdir, synthrepo.repoName(commits, branches, args.length, args.merge_density,
+                                                          args.files_per_commit, args.files, args.seed))
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        synthrepo.build(path + ".tmp", commits, branches, args.length, args.merge_density, args.files_per_commit, args.files, args.seed)
+        os.rename(path + ".tmp", path)
+        print("built {} in {:.1f}s".format(path, time.perf_counter() - start))
+    return path
+
+
+# run script on path once and return its profile
+def profile(path, script, extra, cold):
+    if cold:
+        try:
+            os.remove(os.path.join(path, ".git", "gitutils-graph"))
+        except FileNotFoundError:
+            pass
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+        env = dict(os.environ, BROWSER="true")
+        subprocess.run([sys.executable, os.path.join(scriptDir, script), "-r", path, "--profile-json", f.name] + extra,
+                       stdout=subprocess.DEVNULL, env=env, check=True)
+        return json.load(f)
+
+
+os.makedirs(args.workdir, exist_ok=True)
+out = open(args.output, "a") if args.output != "" else None
+tag = label()
+header = "{:>8} {:>6} {:16} {:>8}".format("commits", "refs", "run", "total")
+print(header + "  phases (best of {}, seconds)".format(args.repeat))
+for size in args.sizes.split(","):
+    (commits, branches) = [int(x) for x in size.split("x")]
+    path = repo(commits, branches)
+    for (name, script, extra, cold) in RUNS:
+        best = None
+        for i in range(args.repeat):
+            data = profile(path, script, extra, cold)
+            if out is not None:
+                out.write(json.dumps({"label": tag, "run": name, "commits": commits, "branches": branches, "length": args.length,
+                                      "merge density": args.merge_density, "files per commit": args.files_per_commit,
+                                      "files": args.files, "seed": args.seed, "repeat": i, "profile": data}) + "\n")
+            if best is None or data["wall"] < best["wall"]:
+                best = data
+        phases = ["{} {:.3f}".format(phase, best["phases"][phase]["wall"]) for phase in COLUMNS[script] if phase in best["phases"]]
+        print("{:>8} {:>6} {:16} {:>8.3f}  {}".format(commits, branches + 1, name, best["wall"], ", ".join(phases)))
+        sys.stdout.flush()
+if out is not None:
+    out.close()
@@ -0,0 +1,91 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# build a synthetic repo for benchmarks with one git fast-import.  The
+# same parameters always give the same repo, down to the shas: dates,
+# names and contents are fixed and all choices come from a seeded
+# random.  The shape is a main branch of commits commits, and branches
+# branches of length commits forking off it at random points.  A
+# mergeDensity share of the branches are merged back into main some
+# time after they fork.  Every commit changes filesPerCommit of files
+# files.
+
+import argparse
+import os
+import random
+import subprocess
+
+
+# name of the repo directory for a set of parameters
+def repoName(commits, branches, length, mergeDensity, filesPerCommit, files, seed):
+    return "c{}-b{}-l{}-m{}-f{}of{}-s{}".format(commits, branches, length, mergeDensity, filesPerCommit, files, seed)
+
+
+def build(path, commits, branches, length=20, mergeDensity=0.0, filesPerCommit=2, files=500, seed=1):
+    rand = random.Random(seed)
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+    proc = subprocess.Popen(["git", "-C", path, "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    out = proc.stdin
+    names = ["d{}/f{}.txt".format(n % 20, n) for n in range(files)]
+    # branch number -> main commit it forks after, and merges into main
+    # at main commit -> branches merged there
+    forks = {}
+    merges = {}
+    for branch in range(branches):
+        fork = rand.randrange(max(commits - 1, 1))
+        forks.setdefault(fork, []).append(branch)
+        if rand.random() < mergeDensity and fork + 1 < commits:
+            merges.setdefault(rand.randrange(fork + 1, commits), []).append(branch)
+    state = {"mark": 0, "date": 1500000000}
+    tips = {}
+
+    def commit(ref, parents):
+        state["mark"] += 1
+        state["date"] += 60
+        mark = state["mark"]
+        lines = ["commit {}".format(ref), "mark :{}".format(mark),
+                 "committer Bench <bench@example.com> {} +0000".format(state["date"])]
+        message = "commit {}".format(mark)
+        lines.append("data {}".format(len(message)))
+        lines.append(message)
+        if len(parents) > 0:
+            lines.append("from :{}".format(parents[0]))
+        for parent in parents[1:]:
+            lines.append("merge :{}".format(parent))
+        for name in rand.sample(names, min(filesPerCommit, files)):
+            content = "{} {}\n".format(name, mark)
+            lines.append("M 644 inline {}".format(name))
+            lines.append("data {}".format(len(content)))
+            lines.append(content)
+        out.write(("\n".join(lines) + "\n").encode())
+        return mark
+
+    main = None
+    for i in range(commits):
+        parents = [] if main is None else [main]
+        parents += [tips[branch] for branch in merges.get(i, [])]
+        main = commit("refs/heads/main", parents)
+        for branch in forks.get(i, []):
+            tip = main
+            for j in range(length):
+                tip = commit("refs/heads/b{}".format(branch), [tip])
+            tips[branch] = tip
+    out.close()
+    if proc.wait() != 0:
+        raise RuntimeError("fast-import failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build a deterministic synthetic repo with git fast-import",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-c", "--commits", type=int, default=10000, help="commits on main")
+    parser.add_argument("-b", "--branches", type=int, default=50, help="number of branches")
+    parser.add_argument("-l", "--length", type=int, default=20, help="commits on each branch")
+    parser.add_argument("-m", "--merge-density", type=float, default=0.0, help="share of branches merged back into main")
+    parser.add_argument("-f", "--files-per-commit", type=int, default=2, help="files each commit changes")
+    parser.add_argument("--files", type=int, default=500, help="files in the repo")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="random seed")
+    parser.add_argument("path", help="where to create the repo (must not exist)")
+    args = parser.parse_args()
+    if os.path.exists(args.path):
+        parser.error("{} already exists".format(args.path))
+    build(args.path, args.commits, args.branches, args.length, args.merge_density, args.files_per_commit, args.files, args.seed)
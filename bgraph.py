@@ -8,21 +8,68 @@ import argparse
 import sys
 import os
 import webbrowser
+import json
+import io
+from timeit import default_timer as timer
+from graphstore import GraphStore
+from graphcache import GraphCache
+from filechanges import FileChanges
+import refs
+import graphexport
+import refwatch
+import treeserver
+import time
+import instrument
 
 scriptDir = os.path.realpath(os.path.dirname(__file__))
 
 parser = argparse.ArgumentParser(description="show how branches are related", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("-v", "--verbose", action="store_true", help="be verbose")
-parser.add_argument("-R", "--remote", action="store_true", help="include remote branches")
+parser.add_argument("-R", "--remote", action="store_true", help="include remote branches (of all remotes)")
+parser.add_argument("-t", "--tags", action="store_true", help="include tags")
 parser.add_argument("-r", "--repodir", default=".", help="base of repo")
+parser.add_argument("--nocache", action="store_true", help="do not use or update the commit graph cache in .git")
+parser.add_argument("--segments", choices=["tree", "union"], default="tree",
+                    help="files for a branch: diff from split point to tip (tree) or every file any commit touched (union)")
+parser.add_argument("-m", "--merges", action="store_true",
+                    help="read every parent, not just the first, to show which branches were merged (does not use the cache)")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="processes to read branch history with")
+parser.add_argument("--inline-depth", type=int, default=4, help="levels of the tree written into tree.html, deeper ones load when expanded")
+parser.add_argument("--inline-width", type=int, default=50, help="nodes with more children than this load them when expanded")
+parser.add_argument("-c", "--columns", type=int, default=0, help="most columns the text graph may use (0 for no limit)")
+parser.add_argument("-e", "--export", default="",
+                    help="write the graph to this file ('-' for stdout) instead of showing it, see graphexport.py")
+parser.add_argument("--format", choices=["jsonl", "binary"], default="jsonl", help="format for --export")
+parser.add_argument("-w", "--watch", type=float, default=0,
+                    help="keep running and refresh the output whenever a ref moves, checking every WATCH seconds")
+parser.add_argument("--serve", type=int, default=0,
+                    help="while watching, serve tree.html and the export (/graph.jsonl) on this localhost port")
 parser.add_argument("-a", "--after", default="", help="Only include branches with at least one commit after date")
 parser.add_argument("branches", nargs='*', help="branches to compare")
+instrument.addArguments(parser)
 args = parser.parse_args()
+instrument.fromArguments(args)
 verbose = args.verbose
 includeRemote = args.remote
+includeTags = args.tags
 repodir = args.repodir
 branches = args.branches
 after = args.after
+useMerges = args.merges
+useCache = not args.nocache and not useMerges
+segmentMode = args.segments
+inlineDepth = args.inline_depth
+inlineWidth = args.inline_width
+maxColumns = args.columns
+exportPath = args.export
+servePort = args.serve
+watchInterval = args.watch
+if servePort != 0 and watchInterval <= 0:
+    watchInterval = 1
+if exportPath == "-":
+    # the export gets stdout to itself, everything else goes to stderr
+    exportOut = sys.stdout.buffer
+    sys.stdout = sys.stderr
 ignoreBefore = datetime(1970, 1, 1, 0, 0)
 if after != "":
     ignoreBefore = datetime.strptime(after, "%m/%d/%y")
@@ -50,43 +97,89 @@ print("Working on Repo at: {}".format(cwd))
 # helper routines
 
 
-# get all branches.  If remote=true, include remote braches
-# return dictionary
-def getAllBranches(remote=False):
-    result = {}
-    for branch in repo.branches:
-        result[branch.name] = branch
+# read every ref into a refs.RefIndex, which looks up the names given
+# on the command line (branches, origin/foo, tags, shas)
+def getAllBranches():
+    start = timer()
+    index = refs.RefIndex(repo.working_tree_dir, store if useCache else None)
+    print("Read {} refs in {:.3f}s".format(len(index.refs), timer() - start))
+    return index
+
+
+# the refs shown when no branches are given.  If remote=true, include
+# remote braches, if tags=true include tags.
+def defaultBranches(index, remote=False, tags=False):
+    prefixes = [refs.HEADS]
     if remote:
-        for branch in repo.remote().refs:
-            result[branch.name] = branch
-    return result
+        prefixes.append(refs.REMOTES)
+    if tags:
+        prefixes.append(refs.TAGS)
+    return index.under(prefixes)
 
 
 class Node:
-    # all commits seen so far
-    all = {}
-    root = None
-
-    # create a new node
-    def __init__(self, commit, child):
-        # print("Adding {} as parent of {}".format(commit, child))
-        self.name = None
-        self.commit = commit
-        self.parent = None
-        self.depth = None
-        if child is not None:
-            self.children = [child]
-        else:
-            self.children = []
-        if self.commit.hexsha in Node.all:
-            print("{} is already in dictionary".format(self.getName()))
-            raise ValueError('duplicate in hash')
-        Node.all[self.commit.hexsha] = self
+    # The graph itself lives in the arrays of a GraphStore.  Node
+    # objects are only made for commits we actually show, on first use.
+    store = None
+    names = {}
+    made = {}
+    # with merges: which commits some merge brought in, and {tip:
+    # merge} for the tips that were merged
+    reached = None
+    merged = {}
+
+    # create a new node for commit id idx
+    def __init__(self, idx):
+        self.idx = idx
+        self.name = Node.names.get(idx)
+
+    @staticmethod
+    def get(idx):
+        if idx not in Node.made:
+            Node.made[idx] = Node(idx)
+        return Node.made[idx]
+
+    @property
+    def hexsha(self):
+        return Node.store.hexsha(self.idx)
+
+    @property
+    def date(self):
+        return Node.store.dates[self.idx]
+
+    @property
+    def depth(self):
+        return Node.store.depths[self.idx]
+
+    @property
+    def parent(self):
+        parent = Node.store.parents[self.idx]
+        return None if parent < 0 else Node.get(parent)
+
+    @property
+    def children(self):
+        return [Node.get(child) for child in Node.store.children(self.idx)]
+
+    def numChildren(self):
+        return Node.store.numChildren(self.idx)
+
+    # follow the chain of unnamed only children below self.  Returns
+    # the node it ends at and how many were skipped.
+    def chainEnd(self):
+        (idx, skipped) = Node.store.chainEnd(self.idx, Node.names)
+        return (Node.get(idx), skipped)
 
     def getName(self):
         if self.name is not None:
             return self.name
-        return self.commit.hexsha[0:8]
+        return self.hexsha[0:8]
+
+    # name plus where it was merged, for showing
+    def describe(self):
+        merge = Node.merged.get(self.idx)
+        if merge is None:
+            return self.getName()
+        return "{} (merged at {})".format(self.getName(), Node.store.hexsha(merge)[0:8])
 
     def __str__(self):
         result = ""
@@ -103,246 +196,419 @@ class Node:
         result += " ]"
         return result
 
-    # add parent of self.
-    # If already known, then we don't have to go futher up the chain and return False
-    def addParent(self, parent):
-        if parent.hexsha in Node.all:
-            self.parent = Node.all[parent.hexsha]
-            Node.all[parent.hexsha].children.append(self)
-            return False
-        self.parent = Node(parent, self)
-        return True
-
-    @staticmethod
-    def addIfNeeded(commit):
-        if commit.hexsha in Node.all:
-            return Node.all[commit.hexsha]
-        return Node(commit, None)
-
-    def findDepth(self):
-        if self.depth is not None:
-            return self.depth
-        if self.parent is None:
-            self.depth = 0
-            if Node.root is not None:
-                raise ValueError('More than one root?')
-            Node.root = self
-        else:
-            self.depth = self.parent.findDepth() + 1
-        return self.depth
-
+    # restrict store to what is reachable by first parent from the
+    # named tips and make that the graph we show.  Returns the node
+    # where the tips first split from each other.
     @staticmethod
-    def calcDepth():
-        for node in Node.all.values():
-            node.findDepth()
+    def useStore(store, tips):
+        Node.store = store
+        Node.names = {store.lookup(hexsha): name for (name, hexsha) in tips}
+        if None in Node.names:
+            missing = [name for (name, hexsha) in tips if store.lookup(hexsha) is None]
+            raise ValueError("Tips missing from the graph: {}".format(", ".join(missing)))
+        store.buildChildren(store.closure(Node.names.keys()))
+        fork = store.forkPoint(Node.names.keys())
+        if fork < 0:
+            raise ValueError('More than one root?')
+        if store.merges:
+            (Node.reached, Node.merged) = store.mergesBelow(fork, Node.names.keys())
+        return Node.get(fork)
 
     def filesChangedIn(self):
         # print("finding files changed in {}".format(self.getName()))
-        result = []
-        for fname in self.commit.stats.files.keys():
-            result.append(fname)
-        return result
+        return fileChanges.get(self.hexsha, None if self.parent is None else self.parent.hexsha)
+
+    # find the split point (or previous branch) above self
+    def splitOrBranch(self):
+        start = Node.store.splitPoint(self.idx, Node.names)
+        return None if start < 0 else Node.get(start)
+
+    # where the diff for this branch starts.  Normally the split point,
+    # but with merges it is the newest commit of the branch that has
+    # been merged (self if it was merged outright).
+    def segmentStart(self):
+        start = Node.store.segmentStart(self.idx, Node.names, Node.reached)
+        return None if start < 0 else Node.get(start)
 
     def changesFromSplitOrBranchTo(self):
-        start = self.parent
+        if segmentMode == "tree":
+            start = self.segmentStart()
+            if start is None:
+                return (None, {})
+            return (start, {x: 1 for x in fileChanges.between(start.hexsha, self.hexsha)})
+        start = self.splitOrBranch()
+        if start is None:
+            # nothing above self to compare against
+            return (None, {})
         files = {x: 1 for x in self.filesChangedIn()}
-        while start and len(start.children) == 1 and start.name is None:
-            for x in start.filesChangedIn():
+        node = self.parent
+        while node.idx != start.idx:
+            for x in node.filesChangedIn():
                 files[x] = 1
-            start = start.parent
+            node = node.parent
         return (start, files)
 
+    # read what the html stage will need for everything below self in
+    # one batch, so it doesn't run git once per commit or branch
+    def prefetchChanges(self):
+        if segmentMode == "tree":
+            # only named nodes get a diff, and they are all below self
+            pairs = []
+            for idx in Node.names:
+                if idx != self.idx:
+                    node = Node.get(idx)
+                    pairs.append((node.segmentStart().hexsha, node.hexsha))
+            fileChanges.prefetchSegments(pairs)
+            return
+        pairs = []
+        todo = list(self.children)
+        while len(todo) > 0:
+            node = todo.pop()
+            pairs.append((node.hexsha, node.parent.hexsha))
+            todo.extend(node.children)
+        fileChanges.prefetch(pairs)
+
 ################################################################
 # help routines
 
-def namefield(name, maxlen=16):
-    if len(name) > (maxlen-2):
-        return name[:maxlen-(2+3)]+"...  "
-    return name+" "*(maxlen-len(name))
-
-
-def htmldiff(f, node):
-    if node.name is not None:
-        (src, changes) = node.changesFromSplitOrBranchTo()
-        f.write('<div id="diff-{}" class="diffs"><h1>{} -> {}</h1>\n'.format(node.name, src.getName(), node.name))
-        f.write('<ul><li>From: {}</li><li>To: {}</li></ul>\n'.format(datetime.fromtimestamp(src.commit.committed_date).strftime("%Y-%m-%d"),
-                                                                     datetime.fromtimestamp(node.commit.committed_date).strftime("%Y-%m-%d")))
-        changes = sorted(changes)
-        for line in changes:
-            f.write(' <li>{}</li>\n'.format(line))
-        f.write('</ul></div>\n')
-    for child in node.children:
-        htmldiff(f, child)
-
-
-def htmltree(depth, f, node):
-    prefix = " "*depth
-    f.write('{}<li><span id="{}" class="{}">{}</span>'.format(prefix, node.getName(), "sha" if node.name is None else "branch", node.getName()))
-    if len(node.children) == 0:
-        f.write('</li>\n'.format(prefix))
-        return
-    skipped = 0
-    while len(node.children) == 1 and node.children[0].name is None:
-        node = node.children[0]
-        skipped += 1
-    if skipped > 0:
-        f.write(" +{}".format(skipped))
-    f.write('\n{}<ul>\n'.format(prefix))
-    for child in node.children:
-        htmltree(depth+1, f, child)
-    f.write('{}</ul></li>\n'.format(prefix))
-
-
-def html(f, node):
+# Lay out the tree below node as text, one line per node once chains
+# of unnamed commits are collapsed to "+N" (like htmltree).  A node
+# stays in its parent's column if it has the biggest subtree of its
+# siblings and moves one column right otherwise, so the width is at
+# most log2 of the number of nodes, and never more than maxcol if that
+# is set.  The others are drawn first, then the column carries on:
+#
+#   94bc62bc
+#   |--feat2
+#   eb4a33b8
+#   |--feat
+#   |  x
+#   master +200
+#
+# Two passes over the collapsed tree with explicit stacks, output is
+# written in blocks.
+def textgraph(out, node, maxcol=0):
+    labels = []
+    children = []
+    parents = []
+    todo = [(node, -1)]
+    while len(todo) > 0:
+        (node, parent) = todo.pop()
+        label = node.describe()
+        (node, skipped) = node.chainEnd()
+        if skipped > 0:
+            label += " +{}".format(skipped)
+        idx = len(labels)
+        labels.append(label)
+        children.append([])
+        parents.append(parent)
+        if parent >= 0:
+            children[parent].append(idx)
+        for child in reversed(node.children):
+            todo.append((child, idx))
+    # preorder, so every child comes after its parent
+    size = [1] * len(labels)
+    for idx in range(len(labels) - 1, 0, -1):
+        size[parents[idx]] += size[idx]
+    lines = []
+    todo = [(0, 0, False)]
+    while len(todo) > 0:
+        (idx, col, branched) = todo.pop()
+        cells = col if maxcol <= 0 else min(col, maxcol)
+        prefix = "|  " * cells
+        if branched:
+            prefix = prefix[:-3] + "|--"
+        if cells < col:
+            prefix += "[{}]".format(col)
+        lines.append(prefix + labels[idx])
+        if len(lines) >= 1000:
+            out.write("\n".join(lines) + "\n")
+            lines = []
+        if len(children[idx]) == 0:
+            continue
+        heavy = max(children[idx], key=lambda child: size[child])
+        todo.append((heavy, col, False))
+        for child in reversed(children[idx]):
+            if child != heavy:
+                todo.append((child, col + 1, True))
+    out.write("\n".join(lines) + "\n")
+
+
+# Records tree.js only loads when it needs them (branch diffs,
+# subtrees below the part of the tree that is in tree.html).  They are
+# written out in batches as small scripts that call treeData(), since
+# a page opened from file:// isn't allowed to fetch JSON.
+class Shards:
+
+    def __init__(self, dirname, kind, size=200):
+        self.dirname = dirname
+        self.kind = kind
+        self.size = size
+        self.records = {}
+        self.count = 0
+
+    # add a record and return the number of the shard it ends up in
+    def add(self, key, value):
+        shard = self.count // self.size
+        self.records[key] = value
+        self.count += 1
+        if self.count % self.size == 0:
+            self.flush()
+        return shard
+
+    def flush(self):
+        if len(self.records) == 0:
+            return
+        path = os.path.join(self.dirname, "{}{}.js".format(self.kind, (self.count - 1) // self.size))
+        with open(path, "w") as f:
+            f.write('treeData("{}", {});\n'.format(self.kind, json.dumps(self.records)))
+        self.records = {}
+
+
+# contents of the diff box for branch node
+def htmldiff(node):
+    (src, changes) = node.changesFromSplitOrBranchTo()
+    if src is None:
+        # this branch is where all the others split off from
+        src = node
+        changes = {}
+    lines = ['<h1>{} -> {}</h1>\n'.format(src.getName(), node.name)]
+    lines.append('<ul><li>From: {}</li><li>To: {}</li></ul>\n'.format(datetime.fromtimestamp(src.date).strftime("%Y-%m-%d"),
+                                                                      datetime.fromtimestamp(node.date).strftime("%Y-%m-%d")))
+    if node.idx in Node.merged:
+        lines.append('<p>{}</p>\n'.format(node.describe()))
+    lines.append('<ul>\n')
+    for line in sorted(changes):
+        lines.append(' <li>{}</li>\n'.format(line))
+    lines.append('</ul>\n')
+    return "".join(lines)
+
+
+# write the tree below node as nested lists, collapsing chains of
+# unnamed commits to "+N".  Uses an explicit stack rather than
+# recursion.  Only inlineDepth levels (and at most inlineWidth
+# children of a node) go into f, anything beyond that gets a subtree
+# id and is queued on lazy to be written to a shard instead.
+def htmltree(f, node, diffs, lazy):
+    todo = [(node, 0)]
+    while len(todo) > 0:
+        item = todo.pop()
+        if isinstance(item, str):
+            f.write(item)
+            continue
+        (node, depth) = item
+        prefix = " "*depth
+        if node.name is None:
+            f.write('{}<li><span id="{}" class="sha">{}</span>'.format(prefix, node.getName(), node.getName()))
+        else:
+            shard = diffs.add(node.name, htmldiff(node))
+            f.write('{}<li><span id="{}" class="branch" data-shard="{}">{}</span>'.format(prefix, node.getName(), shard, node.getName()))
+        if node.numChildren() == 0:
+            f.write('</li>\n')
+            continue
+        (node, skipped) = node.chainEnd()
+        if skipped > 0:
+            f.write(" +{}".format(skipped))
+        children = node.children
+        if depth + 1 >= inlineDepth or len(children) > inlineWidth:
+            subtree = lazy.reserve(node)
+            f.write(' <span class="toggle" data-subtree="{}" data-shard="{}">+{}</span></li>\n'.format(subtree, subtree // lazy.size, len(children)))
+            continue
+        f.write(' <span class="toggle">-</span>\n{}<ul>\n'.format(prefix))
+        todo.append('{}</ul></li>\n'.format(prefix))
+        for child in reversed(children):
+            todo.append((child, depth+1))
+
+
+# subtrees that didn't fit in tree.html.  Ids are handed out in the
+# order the subtrees are written, so the shard of an id is known as
+# soon as it is reserved.
+class LazySubtrees(Shards):
+
+    def __init__(self, dirname):
+        Shards.__init__(self, dirname, "t")
+        self.queue = []
+
+    def reserve(self, node):
+        self.queue.append(node)
+        return len(self.queue) - 1
+
+    # write every queued subtree, including the ones queued on the way
+    def write(self, diffs):
+        subtree = 0
+        while subtree < len(self.queue):
+            f = io.StringIO()
+            f.write('<ul>\n')
+            for child in self.queue[subtree].children:
+                htmltree(f, child, diffs, self)
+            f.write('</ul>\n')
+            self.add(str(subtree), f.getvalue())
+            self.queue[subtree] = None
+            subtree += 1
+        self.flush()
+
+
+# write tree.html for the tree below node to f.  tree.css and tree.js
+# are looked for in assets (relative to the page if it is "").
+def html(f, node, datadir, assets=scriptDir):
+    diffs = Shards(datadir, "d")
+    lazy = LazySubtrees(datadir)
     f.write('<head>\n')
-    f.write('<link rel="stylesheet" href="{}">\n'.format(os.path.join(scriptDir, "tree.css")))
-    f.write('<script src="{}"></script>\n'.format(os.path.join(scriptDir, "tree.js")))
+    f.write('<link rel="stylesheet" href="{}">\n'.format(os.path.join(assets, "tree.css")))
+    f.write('<script src="{}"></script>\n'.format(os.path.join(assets, "tree.js")))
     f.write('</head>\n')
     f.write('<body>\n')
     f.write('<div class="tree-diagram">\n')
     f.write('<ul>\n')
     f.write('<li class="tree-diagram__root">root\n<ul>')
-    htmltree(0, f, node)
+    htmltree(f, node, diffs, lazy)
     f.write('</ul></li></ul></div>\n')
     f.write('<script>initialize();</script>\n')
-    # now write out div's for each branch
-    htmldiff(f, node)
     f.write('</body>\n')
+    # everything tree.js loads on demand
+    lazy.write(diffs)
+    diffs.flush()
 
 
 ################################################################
 # main
 
 
-allbranches = getAllBranches(remote=includeRemote)
-if verbose:
-    pprint(allbranches)
-
-# get all branches  (repo.heads is same)
-if len(branches) == 0:
-    branches = allbranches.keys()
-
-# check that branches listed by user are valid
-for branch in branches:
-    if branch not in allbranches:
-        print("{} not a known branch.".format(branch))
-
-# build graph
-for branchname in branches:
-    branch = allbranches[branchname]
-    if branch.commit.committed_date < ignoreBefore:
-        # print("Skipping {}, it is from {}".format(branch.name, datetime.fromtimestamp(branch.commit.committed_date).strftime("%Y-%m-%d")))
-        continue
-    else:
-        print("Including {}".format(branch.name))
-    leaf = Node.addIfNeeded(branch.commit)
-    # print(leaf)
-    leaf.name = branch.name
-    # print(leaf)
-    if leaf.parent:
-        # this was already added, nothing to do
-        continue
-    while len(leaf.commit.parents) > 0:
-        parent = leaf.commit.parents[0]
-        more = leaf.addParent(parent)
-        if not more:
-            break
-        leaf = leaf.parent
-
-Node.calcDepth()
-lca = Node.root
-while len(lca.children) == 1:
-    lca = lca.children[0]
-print('First branch is at depth {}'.format(lca.depth))
-
-# show all nodes after lca
-if False:
-    bydepth = sorted(Node.all.values(), key=lambda x: x.depth)
-    for node in bydepth:
-        if node.depth < lca.depth:
+# (name, hexsha) of each branch to show
+def readTips():
+    with instrument.phase("refs"):
+        index = getAllBranches()
+        if verbose:
+            pprint(index.refs)
+        if len(branches) == 0:
+            found = defaultBranches(index, remote=includeRemote, tags=includeTags)
+        else:
+            # check that branches listed by user are valid
+            found = []
+            for branchname in branches:
+                branch = index.resolve(branchname)
+                if branch is None:
+                    print("{} not a known branch.".format(branchname))
+                    continue
+                found.append(branch)
+
+    tips = []
+    for branch in found:
+        if branch.date < ignoreBefore:
+            # print("Skipping {}, it is from {}".format(branch.name, datetime.fromtimestamp(branch.date).strftime("%Y-%m-%d")))
             continue
-        print(node)
-
-# show graph
-row = [lca]
-while True:
-    nextrow = []
-    connector = []
-    numchildren = []
-    idx = 0
-    allnone = True
-    # print this row
-    for node in row:
-        if node is None:
-            sys.stdout.write("\t\t")
-            nextrow.append(None)
-            connector.append(idx)
-            numchildren.append(0)
         else:
-            sys.stdout.write(namefield(node.getName()))
-            if len(node.children) == 0:
-                nextrow.append(None)
-                connector.append(idx)
-                numchildren.append(0)
-            else:
-                numchildren.append(len(node.children))
-                for child in node.children:
-                    nextrow.append(child)
-                    connector.append(idx)
-                    idx += len(node.children)-1
-                    allnone = allnone and child is None
-    sys.stdout.write("\n")
-    if allnone:
-        break
-    # trim off any None's at the end of nextrow
-    revrow = nextrow[::-1]
-    for nonelen in range(len(revrow)):
-        if revrow[nonelen] is not None:
-            break
-    if nonelen > 0:
-        nextrow = nextrow[:-nonelen]
-    if idx > 1:
-        # print("{} {} {}".format(idx, connector, numchildren))
-        # we had a branch, so put an indicator in
-        cc = "|"
-        nodeIdx = 0
-        inBranch = False
-        # first row
-        nextconnector = []
-        for direc in connector:
-            adjust = " " * 3
-            filler = "\t\t"
-            nextconnector.append("\\")
-            if direc != 0:
-                cc = "\\"
-            numchildren[nodeIdx] -= 1
-            if inBranch:
-                adjust = "-" * 3
-            if numchildren[nodeIdx] > 0:
-                # more children from this node
-                inBranch = True
-                filler = "-" * 12
-            else:
-                inBranch = False
-                filler = "\t\t"
-                if numchildren[nodeIdx] < 0:
-                    cc = " "
-                    nextconnector[-1] = " "
-                nodeIdx += 1
-            sys.stdout.write("{}{}{}".format(adjust, cc, filler))
-        sys.stdout.write("\n")
-        # rest of rows
-        for right in range(1, idx):
-            for cc in nextconnector:
-                adjust = " " * (right+3)
-                filler = "\t\t"
-                sys.stdout.write("{}{}{}".format(adjust, cc, filler))
-            sys.stdout.write("\n")
-    row = nextrow
-
-htmlout = os.path.join(scriptDir, "tree.html")
-with open(htmlout, "w") as outfile:
-    html(outfile, lca)
-webbrowser.open('file://{}'.format(htmlout))
+            print("Including {}".format(branch.name))
+        tips.append((branch.name, branch.hexsha))
+    return tips
+
+
+# read the history of tips and make it the graph we show, returns the
+# node where they first split.  The store (cached or not) stays loaded
+# between calls, so when watching only commits that are new get read.
+def buildGraph(tips):
+    global store
+    if useCache:
+        if store is None:
+            with instrument.phase("load cache"):
+                store = GraphCache(repo.common_dir)
+            store.jobs = args.jobs
+        with instrument.phase("history"):
+            added = store.update(repo.working_tree_dir, [hexsha for (name, hexsha) in tips])
+            store.save()
+        if verbose:
+            print("Read {} new commits, graph cache has {}".format(added, len(store)))
+    else:
+        with instrument.phase("history"):
+            added = None if store is None else store.update(repo.working_tree_dir, [hexsha for (name, hexsha) in tips])
+            if added is None:
+                store = GraphStore()
+                store.jobs = args.jobs
+                store.merges = useMerges
+                # only read back to where the branches meet
+                store.readHistory(repo.working_tree_dir, [hexsha for (name, hexsha) in tips], bounded=True)
+            elif verbose:
+                print("Read {} new commits".format(added))
+    Node.made = {}
+    with instrument.phase("fork point"):
+        lca = Node.useStore(store, tips)
+    print('First branch is at depth {}{}'.format(lca.depth, "" if useCache else " (counted from the merge-base)"))
+
+    # show all nodes after lca
+    if False:
+        bydepth = sorted(Node.made.values(), key=lambda x: x.depth)
+        for node in bydepth:
+            if node.depth < lca.depth:
+                continue
+            print(node)
+    return lca
+
+
+# write the export for lca to out
+def export(out, lca):
+    writer = graphexport.BinaryExport(out) if args.format == "binary" else graphexport.JsonLinesExport(out)
+    with instrument.phase("export"):
+        graphexport.exportGraph(writer, store, lca.idx, Node.names, Node.merged, Node.reached,
+                                fileChanges, segmentMode, remember=watchInterval > 0)
+
+
+# rewrite whatever we output for lca
+def refresh(lca):
+    if exportPath == "-":
+        export(exportOut, lca)
+    elif exportPath != "":
+        # readers never see half an export
+        with open(exportPath + ".tmp", "wb") as out:
+            export(out, lca)
+        os.replace(exportPath + ".tmp", exportPath)
+    if server is not None:
+        out = io.BytesIO()
+        with instrument.phase("export"):
+            graphexport.exportGraph(graphexport.JsonLinesExport(out), store, lca.idx, Node.names, Node.merged, Node.reached,
+                                    fileChanges, segmentMode, remember=True)
+        server.export = out.getvalue()
+    elif exportPath != "":
+        return
+
+    # show graph
+    with instrument.phase("text"):
+        textgraph(sys.stdout, lca, maxColumns)
+
+    with instrument.phase("file changes"):
+        lca.prefetchChanges()
+    htmlout = os.path.join(scriptDir, "tree.html")
+    datadir = os.path.join(scriptDir, "tree-data")
+    os.makedirs(datadir, exist_ok=True)
+    with instrument.phase("html"):
+        for name in os.listdir(datadir):
+            if name.endswith(".js"):
+                os.remove(os.path.join(datadir, name))
+        with open(htmlout, "w") as outfile:
+            html(outfile, lca, datadir, "" if server is not None else scriptDir)
+
+
+store = None
+server = None
+fileChanges = FileChanges(repo.working_tree_dir)
+if servePort != 0:
+    server = treeserver.TreeServer(servePort, scriptDir)
+    print("Serving on {}".format(server.url))
+if watchInterval > 0:
+    watcher = refwatch.RefWatcher(repo.common_dir)
+refresh(buildGraph(readTips()))
+if exportPath == "" or server is not None:
+    webbrowser.open(server.url if server is not None else 'file://{}'.format(os.path.join(scriptDir, "tree.html")))
+
+# when watching, the graph cache and the file lists stay in memory and
+# each refresh only reads what moved
+while watchInterval > 0:
+    time.sleep(watchInterval)
+    if not watcher.changed():
+        continue
+    start = timer()
+    refresh(buildGraph(readTips()))
+    print("Refreshed in {:.3f}s".format(timer() - start))
 
+if exportPath == "-":
+    exportOut.close()
 exit(0)
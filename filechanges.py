@@ -0,0 +1,104 @@
+# Files changed by each commit, read for many commits at once from a
+# single diff-tree instead of one `git diff --numstat` per
+# commit.stats.  Results are kept, so asking again is free.  The same
+# batching also gives the files that differ between the two ends of a
+# branch segment.
+
+import collections
+import gitstream
+import instrument
+
+
+class FileChanges:
+
+    def __init__(self, repodir):
+        self.repodir = repodir
+        self.files = {}
+        self.segments = {}
+
+    # run one diff-tree over (hexsha, base) pairs and yield (hexsha,
+    # files) for each pair in order.  A base of None means diff against
+    # the empty tree.  todo can be any iterable; pairs are handed to git
+    # as they are taken and results come back as git produces them, so
+    # nothing here grows with the number of pairs.
+    def diffTree(self, todo):
+        asked = collections.deque()
+
+        def lines():
+            for (hexsha, base) in todo:
+                asked.append(hexsha)
+                yield hexsha if base is None else "{} {}".format(hexsha, base)
+
+        # --always gives a header even for empty diffs, so headers come
+        # back in exactly the order we asked for them
+        hexsha = None
+        current = None
+        for record in gitstream.gitLines(self.repodir, ["diff-tree", "--stdin", "--always", "--root", "-r", "-z", "--name-only"],
+                                         input=lines(), sep='\0'):
+            if len(asked) > 0 and record == asked[0]:
+                if current is not None:
+                    yield (hexsha, current)
+                hexsha = asked.popleft()
+                current = []
+            elif record != "":
+                current.append(record)
+        if current is not None:
+            yield (hexsha, current)
+
+    # read the changed files for every (hexsha, parent hexsha) pair we
+    # don't know yet.  parent is the commit to diff against (the first
+    # parent, like commit.stats) or None for a root commit.
+    def prefetch(self, pairs):
+        todo = []
+        seen = set()
+        for (hexsha, parent) in pairs:
+            if hexsha in self.files or hexsha in seen:
+                continue
+            seen.add(hexsha)
+            todo.append((hexsha, parent))
+        instrument.hits("commit files", len(pairs) - len(todo), len(todo))
+        if len(todo) == 0:
+            return
+        for (hexsha, files) in self.diffTree(todo):
+            self.files[hexsha] = files
+
+    # list of files changed in hexsha
+    def get(self, hexsha, parent):
+        if hexsha not in self.files:
+            self.prefetch([(hexsha, parent)])
+        return self.files[hexsha]
+
+    # read the files that differ between base and tip for every (base,
+    # tip) pair we don't know yet
+    def prefetchSegments(self, pairs):
+        pairs = set(pairs)
+        todo = [(tip, base) for (base, tip) in pairs if (base, tip) not in self.segments]
+        instrument.hits("segment files", len(pairs) - len(todo), len(todo))
+        if len(todo) == 0:
+            return
+        for ((tip, base), (hexsha, files)) in zip(todo, self.diffTree(todo)):
+            self.segments[(base, tip)] = files
+
+    # list of files that differ between base and tip
+    def between(self, base, tip):
+        if (base, tip) not in self.segments:
+            self.prefetchSegments([(base, tip)])
+        return self.segments[(base, tip)]
+
+    # yield the files that differ between base and tip for each (base,
+    # tip) pair, in order.  Pairs we know come from what was kept and
+    # the rest from one streaming diff-tree, which are only kept if
+    # remember is set.
+    def streamSegments(self, pairs, remember=False):
+        pairs = list(pairs)
+        missing = {pair for pair in pairs if pair not in self.segments}
+        instrument.hits("segment files", len(pairs) - len(missing), len(missing))
+        diffs = self.diffTree((tip, base) for (base, tip) in pairs if (base, tip) in missing)
+        for pair in pairs:
+            if pair not in missing:
+                yield self.segments[pair]
+                continue
+            (hexsha, files) = next(diffs)
+            if remember:
+                self.segments[pair] = files
+            yield files
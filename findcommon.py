@@ -5,20 +5,45 @@ from pprint import pprint
 from datetime import datetime
 import argparse
 import sys
+import gitstream
+from graphcache import GraphCache
+from graphstore import GraphStore
+from filechanges import FileChanges
+from patchids import PatchIds
+from refs import RefIndex
+import instrument
 
 parser = argparse.ArgumentParser(description="Compare the commits starting from LCA of two branches")
 parser.add_argument("-r", "--repodir", default="/home/seth/research/pco/wallet", help="base of repo")
 parser.add_argument("-s", "--showmsgs", action="store_true", help="show messages as well")
-parser.add_argument("aname", nargs=1, help="branch A")
-parser.add_argument("bname", nargs=1, help="branch B")
+parser.add_argument("--nocache", action="store_true", help="do not use or update the commit graph cache in .git")
+parser.add_argument("-n", "--limit", type=int, default=0, help="only show the newest this many commits of each branch (0 for all)")
+parser.add_argument("--since", default="", help="only show commits made after date (mm/dd/yy)")
+parser.add_argument("-p", "--patch-ids", action="store_true",
+                    help="match commits that make the same change on both sides (cherry-picks, rebases) by git patch-id")
+parser.add_argument("-M", "--matrix", action="store_true",
+                    help="compare any number of branches with each other: ahead/behind counts, LCA and files changed on both sides")
+parser.add_argument("-b", "--base", default="", help="like --matrix, but compare each branch with just this one")
+parser.add_argument("--files", action="store_true", help="with --matrix or --base, list the files changed on both sides")
+parser.add_argument("branches", nargs="+",
+                    help="branch A and branch B (branches, remote branches, tags or shas), or with --matrix/--base any number of them or patterns (e.g., 'release/*')")
+instrument.addArguments(parser)
 args = parser.parse_args()
-aname = args.aname[0]
-bname = args.bname[0]
+instrument.fromArguments(args)
+matrix = args.matrix or args.base != ""
+if not matrix and len(args.branches) != 2:
+    parser.error("need exactly two branches (or --matrix)")
+aname = args.branches[0]
+bname = args.branches[-1]
 showmsgs = args.showmsgs
+sinceDate = datetime.strptime(args.since, "%m/%d/%y").timestamp() if args.since != "" else None
+useCache = not args.nocache
 
 repodir = args.repodir
 repo = Repo(repodir)
 assert not repo.bare
+with instrument.phase("load cache"):
+    cache = GraphCache(repo.common_dir) if useCache else None
 
 # show untracked files on active branch
 if False:
@@ -35,59 +60,221 @@ if False:
         print("Remote: {}".format(refs.name))
 
 
-def getHistory(start):
+# a store holding the first-parent history of both tips.  With the
+# cache that is the cache itself, otherwise just what is needed to
+# get back to where they meet, so the cost depends on how far the
+# branches have diverged rather than on the age of the repo.
+def getHistory(tips):
+    if cache is not None:
+        cache.update(repo.working_tree_dir, tips)
+        cache.save()
+        return cache
+    store = GraphStore()
+    store.readHistory(repo.working_tree_dir, tips, bounded=True)
+    return store
+
+
+# hexshas of the first-parent chain from tip back to (not including)
+# base, oldest first
+def since(store, tip, base):
     history = []
-    while start is not None:
-        history.append(start)
-        if len(start.parents) == 0:
-            history.reverse()
-            return history
-        start = start.parents[0]
+    for idx in store.chain(tip):
+        if idx == base:
+            break
+        history.append(store.hexsha(idx))
+    history.reverse()
+    return history
 
 
+# refs.Ref for a branch, remote branch, tag or sha
 def getBranch(name):
-    branches = repo.branches
-    for branch in branches:
-        if name == branch.name:
-            return branch
-    print("Did not find branch: '{}'".format(name))
-    return None
+    branch = refIndex.resolve(name)
+    if branch is None:
+        print("Did not find branch: '{}'".format(name))
+    return branch
+
 
+# commits with the same patch id as a commit on the other side -> that commit
+equivalent = {}
 
-def oneLiner(commit):
-    sys.stdout.write("{} {} {: <15.15} | ".format(datetime.fromtimestamp(commit.committed_date).strftime("%Y-%m-%d"), commit.hexsha[0:8], commit.author.name))
-    for fname in commit.stats.files.keys():
-        sys.stdout.write("\t{}".format(fname))
+
+def oneLiner(hexsha, date, author, message, files):
+    parts = ["{} {} {: <15.15} ".format(datetime.fromtimestamp(date).strftime("%Y-%m-%d"), hexsha[0:8], author)]
+    if hexsha in equivalent:
+        parts.append("= {} ".format(equivalent[hexsha][0:8]))
+    parts.append("| ")
+    for fname in files:
+        parts.append("\t{}".format(fname))
     if showmsgs:
-        if len(commit.message) > 0:
-            sys.stdout.write("\n\t{}".format(commit.message))
-    sys.stdout.write("\n")
+        if len(message) > 0:
+            parts.append("\n\t{}".format(message))
+    parts.append("\n")
+    return "".join(parts)
+
 
+# the commits of history (hexshas, oldest first) that are in the
+# --since/--limit window
+def window(history):
+    if sinceDate is not None:
+        history = [x for x in history if store.dates[store.lookup(x)] >= sinceDate]
+    if args.limit > 0:
+        history = history[-args.limit:]
+    return history
 
+
+# everything for the one-liners comes from a single git log for the
+# whole range, written out in chunks as it arrives
 def oneLiners(history, branchname):
-    print("======== {}".format(branchname))
-    for c in history:
-        oneLiner(c)
+    shown = window(history)
+    if len(shown) < len(history):
+        print("======== {} ({} of {} commits)".format(branchname, len(shown), len(history)))
+    else:
+        print("======== {}".format(branchname))
+    chunk = []
+    for record in gitstream.logRecords(repo.working_tree_dir, shown):
+        chunk.append(oneLiner(*record))
+        if len(chunk) >= 256:
+            sys.stdout.write("".join(chunk))
+            chunk = []
+    sys.stdout.write("".join(chunk))
+    sys.stdout.flush()
+
+
+# refs matching any of patterns, in the order given.  Anything that
+# isn't a pattern is looked up like getBranch.
+def getBranches(patterns):
+    found = {}
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            matched = refIndex.match(pattern)
+        else:
+            branch = refIndex.resolve(pattern)
+            matched = [] if branch is None else [branch]
+        if len(matched) == 0:
+            print("Did not find branch: '{}'".format(pattern))
+        for branch in matched:
+            found.setdefault(branch.name, branch)
+    return list(found.values())
+
+
+# files changed on each side since base, and on both, for every
+# (base, tip, other tip) in todo, from a single diff-tree
+def sideFiles(todo):
+    # with no common history, everything in the tree counts
+    empty = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+    pairs = [(base or empty, tip) for (base, a, b) in todo for tip in (a, b)]
+    changes = FileChanges(repo.working_tree_dir)
+    changes.prefetchSegments(pairs)
+    result = []
+    for (base, a, b) in todo:
+        afiles = set(changes.between(base or empty, a))
+        bfiles = set(changes.between(base or empty, b))
+        result.append((afiles, bfiles, afiles & bfiles))
+    return result
+
+
+# compare every branch with every other one (or each with base) from
+# one read of their history: ahead/behind counts, where they meet and
+# the files changed on both sides since then
+def compareAll(branches, base):
+    tipshas = [branch.hexsha for branch in branches]
+    with instrument.phase("history"):
+        store = getHistory(tipshas)
+    tips = [store.lookup(hexsha) for hexsha in tipshas]
+    if base is not None:
+        pairs = [(i, 0) for i in range(1, len(tips))]
+    else:
+        pairs = [(i, j) for i in range(len(tips)) for j in range(i + 1, len(tips))]
+    with instrument.phase("lca"):
+        lcas = store.chainBases(tips, pairs)
+
+    # commits on i's chain since lca
+    def ahead(i, lca):
+        return store.depths[tips[i]] - (store.depths[lca] if lca >= 0 else -1)
+
+    with instrument.phase("file changes"):
+        files = sideFiles([(store.hexsha(lca) if lca >= 0 else None, tipshas[i], tipshas[j]) for ((i, j), lca) in zip(pairs, lcas)])
+    with instrument.phase("output"):
+        width = max([len("branch")] + [len(branch.name) for branch in branches])
+        if base is not None:
+            print("Comparing with {}".format(base.name))
+            print("{:{}} {:8} {:>7} {:>7} {:>6} {:>6} {:>6}".format("branch", width, "lca", "ahead", "behind", "files", "base", "both"))
+        else:
+            # ahead/behind of each row branch against each column branch
+            print("{:>3} {:{}}".format("", "", width) + "".join(" {:>11}".format(j) for j in range(len(branches))))
+            cells = {}
+            for ((i, j), lca) in zip(pairs, lcas):
+                cells[(i, j)] = "{}/{}".format(ahead(i, lca), ahead(j, lca))
+                cells[(j, i)] = "{}/{}".format(ahead(j, lca), ahead(i, lca))
+            for (i, branch) in enumerate(branches):
+                print("{:>3} {:{}}".format(i, branch.name, width) + "".join(" {:>11}".format(cells.get((i, j), "-")) for j in range(len(branches))))
+            print()
+            print("{:{}} {:{}} {:8} {:>6} {:>6} {:>6}".format("branch", width, "other", width, "lca", "files", "other", "both"))
+        for ((i, j), lca, (ifiles, jfiles, both)) in zip(pairs, lcas, files):
+            at = store.hexsha(lca)[:8] if lca >= 0 else "-"
+            if base is not None:
+                print("{:{}} {:8} {:>7} {:>7} {:>6} {:>6} {:>6}".format(branches[i].name, width, at, ahead(i, lca), ahead(j, lca),
+                                                                     len(ifiles), len(jfiles), len(both)))
+            else:
+                print("{:{}} {:{}} {:8} {:>6} {:>6} {:>6}".format(branches[i].name, width, branches[j].name, width, at,
+                                                               len(ifiles), len(jfiles), len(both)))
+            if args.files:
+                for name in sorted(both):
+                    print("\t{}".format(name))
+
 
+with instrument.phase("refs"):
+    refIndex = RefIndex(repo.working_tree_dir, cache)
+if matrix:
+    with instrument.phase("refs"):
+        branches = getBranches(args.branches)
+        base = None
+        if args.base != "":
+            base = getBranch(args.base)
+            if base is None:
+                sys.exit(1)
+            branches = [base] + [branch for branch in branches if branch.name != base.name]
+    if len(branches) < 2:
+        sys.exit("need at least two branches to compare")
+    compareAll(branches, base)
+    sys.exit(0)
 
-A = getBranch(aname)
-Alog = getHistory(A.commit)
-maxA = len(Alog)
-B = getBranch(bname)
-Blog = getHistory(B.commit)
-maxB = len(Blog)
-print(maxA, maxB)
+with instrument.phase("refs"):
+    A = getBranch(aname)
+    B = getBranch(bname)
+if A is None or B is None:
+    sys.exit(1)
+with instrument.phase("history"):
+    store = getHistory([A.hexsha, B.hexsha])
 
 # find last common ansector
-newest = len(Alog) if len(Alog) < len(Blog) else len(Blog)
-lastCommon = 0
-for i in range(newest):
-    # print(Alog[maxA-i], Blog[maxB-i])
-    # print(datetime.fromtimestamp(Alog[maxA-i].committed_date).strftime("%Y-%m-%d"), Alog[maxA-i].author, Alog[maxA-i].hexsha, Alog[maxA-i].message)
-    if Alog[i] != Blog[i]:
-        break
-    lastCommon = i
+with instrument.phase("lca"):
+    a = store.lookup(A.hexsha)
+    b = store.lookup(B.hexsha)
+    lca = store.chainBase(a, b)
+    Alog = since(store, a, lca)
+    Blog = since(store, b, lca)
+print(len(Alog), len(Blog))
 print("Looking in {} between {} and {}".format(repodir, aname, bname))
-print("LCA is at {}: {}".format(lastCommon, Alog[lastCommon].hexsha[:8]))
-oneLiners(Alog[lastCommon+1:], aname)
-oneLiners(Blog[lastCommon+1:], bname)
+if lca < 0:
+    print("No common ancestor")
+else:
+    print("LCA is {}".format(store.hexsha(lca)[:8]))
+if args.patch_ids:
+    with instrument.phase("patch ids"):
+        patchids = PatchIds(repo.common_dir if useCache else None)
+        ids = patchids.get(repo.working_tree_dir, Alog + Blog)
+        patchids.save()
+        for (mine, theirs) in ((Alog, Blog), (Blog, Alog)):
+            first = {}
+            for hexsha in theirs:
+                if hexsha in ids:
+                    first.setdefault(ids[hexsha], hexsha)
+            for hexsha in mine:
+                if ids.get(hexsha) in first:
+                    equivalent[hexsha] = first[ids[hexsha]]
+    print("{} of {} and {} of {} have an equivalent commit on the other side (marked =)".format(
+        sum(1 for x in Alog if x in equivalent), aname, sum(1 for x in Blog if x in equivalent), bname))
+with instrument.phase("output"):
+    oneLiners(Alog, aname)
+    oneLiners(Blog, bname)
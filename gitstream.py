@@ -0,0 +1,138 @@
+# Helpers for reading git output as a stream instead of going through
+# GitPython objects one at a time.  Used by bgraph.py and findcommon.py
+
+import subprocess
+import threading
+import instrument
+
+BLOCKSIZE = 1 << 16
+
+
+def feed(pipe, input):
+    try:
+        for x in input:
+            pipe.write("{}\n".format(x).encode())
+        pipe.close()
+    except BrokenPipeError:
+        # git went away early (or we stopped reading and killed it)
+        pass
+
+
+# run git in repodir and yield each record of its output as it
+# arrives.  Records are separated by sep ('\0' for -z output).  If
+# input is given it is fed to git on stdin (e.g., for --stdin), or
+# stdin can be the output pipe of another process.
+def gitLines(repodir, args, input=None, sep='\n', stdin=subprocess.DEVNULL):
+    instrument.count("git " + args[0])
+    proc = subprocess.Popen(["git", "-C", repodir] + args,
+                            stdin=subprocess.PIPE if input is not None else stdin,
+                            stdout=subprocess.PIPE)
+    if input is not None:
+        # some commands (diff-tree) write while they are still reading,
+        # so feed stdin from another thread or both pipes can fill up
+        threading.Thread(target=feed, args=(proc.stdin, input), daemon=True).start()
+    bsep = sep.encode()
+    partial = b""
+    finished = False
+    try:
+        while True:
+            block = proc.stdout.read1(BLOCKSIZE)
+            if len(block) == 0:
+                break
+            records = (partial + block).split(bsep)
+            partial = records.pop()
+            for record in records:
+                yield record.decode(errors="replace")
+        if len(partial) > 0:
+            yield partial.decode(errors="replace")
+        finished = True
+    finally:
+        proc.stdout.close()
+        if not finished:
+            # the caller stopped early, so git may still be writing
+            proc.kill()
+            proc.wait()
+    if proc.wait() != 0:
+        raise RuntimeError("git {} failed with status {}".format(args[0], proc.returncode))
+
+
+# stream every commit reachable by first parent from tips.
+# yields (hexsha, committer timestamp, [parent hexsha]) in the order
+# rev-list produces them, i.e., children before their parents.
+def firstParents(repodir, tips):
+    for line in gitLines(repodir, ["rev-list", "--first-parent", "--parents", "--timestamp", "--stdin"], input=tips):
+        fields = line.split()
+        yield (fields[1], int(fields[0]), fields[2:3])
+
+
+# like firstParents, but everything reachable from tips by any parent
+# and every parent of each commit
+def allParents(repodir, tips):
+    for line in gitLines(repodir, ["rev-list", "--parents", "--timestamp", "--stdin"], input=tips):
+        fields = line.split()
+        yield (fields[1], int(fields[0]), fields[2:])
+
+
+# those of hexshas that are not in the repo (gc pruned them, say), from
+# one cat-file
+def missing(repodir, hexshas):
+    gone = []
+    for line in gitLines(repodir, ["cat-file", "--batch-check=%(objectname)"], input=hexshas):
+        if line.endswith(" missing"):
+            gone.append(line.split()[0])
+    return gone
+
+
+# yield (patch id, hexsha) for each of hexshas that has a patch (merges
+# and empty commits don't), from one diff-tree piped into one patch-id
+def patchIds(repodir, hexshas):
+    instrument.count("git diff-tree")
+    diff = subprocess.Popen(["git", "-C", repodir, "diff-tree", "--stdin", "-p", "--root"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    threading.Thread(target=feed, args=(diff.stdin, hexshas), daemon=True).start()
+    try:
+        for line in gitLines(repodir, ["patch-id", "--stable"], stdin=diff.stdout):
+            (patchid, hexsha) = line.split()
+            yield (patchid, hexsha)
+    finally:
+        # patch-id has its own copy of the pipe
+        diff.stdout.close()
+        diff.wait()
+
+
+# yield (hexsha, committer timestamp, author name, message, files) for
+# each of hexshas (a list), in the order given, from one git log.
+# Files are what changed against the first parent, like FileChanges.
+def logRecords(repodir, hexshas):
+    if len(hexshas) == 0:
+        # git log would show HEAD
+        return
+    # -z ends the header and every file name with a NUL, so headers are
+    # told apart from file names by starting them with \x1e
+    args = ["log", "--no-walk=unsorted", "--stdin", "--diff-merges=first-parent", "--name-only", "-z",
+            "--format=%x1e%H%x1f%ct%x1f%an%x1f%B"]
+    record = None
+    for field in gitLines(repodir, args, input=hexshas, sep='\0'):
+        if field.startswith("\x1e"):
+            if record is not None:
+                yield record
+            (hexsha, date, author, message) = field[1:].split("\x1f", 3)
+            record = (hexsha, int(date), author, message, [])
+        elif record is not None:
+            # a newline separates the header from the first file
+            if len(record[4]) == 0 and field.startswith("\n"):
+                field = field[1:]
+            if field != "":
+                record[4].append(field)
+    if record is not None:
+        yield record
+
+
+# best common ancestor of all of commits (octopus merge-base), or None
+# if they have no history in common
+def mergeBase(repodir, commits):
+    instrument.count("git merge-base")
+    result = subprocess.run(["git", "-C", repodir, "merge-base", "--octopus"] + list(commits), stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode().strip()
@@ -0,0 +1,129 @@
+# Persistent first-parent commit graph kept under .git so bgraph.py
+# and findcommon.py don't have to rebuild history on every run.
+#
+# The file is a small header followed by fixed size records, one per
+# commit: raw sha, index of first parent (-1 for a root), committer
+# date and depth (distance from the root by first parent).  Records are
+# only ever appended, so indices stay valid and an update writes just
+# the new commits and then the new count in the header.  Every commit
+# in the cache has its whole first-parent chain in the cache, so a tip
+# that is already in the cache needs no git call at all.
+
+import fcntl
+import os
+import struct
+import instrument
+from graphstore import GraphStore
+
+CACHENAME = "gitutils-graph"
+
+
+class GraphCache(GraphStore):
+    MAGIC = b"GUGC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sII")
+    RECORD = struct.Struct("<20siqi")
+
+    def __init__(self, gitdir):
+        GraphStore.__init__(self)
+        self.path = os.path.join(gitdir, CACHENAME)
+        self.saved = 0
+        # set when what is on disk is stale and save() must replace it
+        self.rebuilt = False
+        self.load()
+
+    # read what is on disk.  A missing, foreign or truncated file just
+    # leaves us with an empty cache.
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        self.parse(data)
+
+    # the records counted in the header of data, if it is a usable cache
+    def parse(self, data):
+        if len(data) < GraphCache.HEADER.size:
+            return
+        (magic, version, count) = GraphCache.HEADER.unpack_from(data)
+        end = GraphCache.HEADER.size + count * GraphCache.RECORD.size
+        if magic != GraphCache.MAGIC or version != GraphCache.VERSION or len(data) < end:
+            print("Ignoring unusable graph cache {}".format(self.path))
+            return
+        for (sha, parent, date, depth) in GraphCache.RECORD.iter_unpack(data[GraphCache.HEADER.size:end]):
+            self.index[sha] = len(self.parents)
+            self.shas += sha
+            self.parents.append(parent)
+            self.dates.append(date)
+            self.depths.append(depth)
+        self.saved = count
+
+    # Append records added since the last load/save and then update the
+    # count.  The file is locked while we do, and if another process
+    # (bgraph -w and findcommon, say) saved since we loaded, what it
+    # wrote is taken in first so both sets of records keep their
+    # parents.  That renumbers what we added, so ids from before a save
+    # must be looked up again.
+    def save(self):
+        if len(self) == self.saved:
+            return
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            header = f.read(GraphCache.HEADER.size)
+            onDisk = GraphCache.HEADER.unpack(header) if len(header) == GraphCache.HEADER.size else (None, None, 0)
+            if onDisk != (GraphCache.MAGIC, GraphCache.VERSION, self.saved) and not self.rebuilt:
+                self.merge(f)
+            count = len(self)
+            if self.saved == 0:
+                f.seek(0)
+                f.write(GraphCache.HEADER.pack(GraphCache.MAGIC, GraphCache.VERSION, 0))
+            # anything past the saved records is left over from an interrupted save
+            f.seek(GraphCache.HEADER.size + self.saved * GraphCache.RECORD.size)
+            f.truncate()
+            for idx in range(self.saved, count):
+                f.write(GraphCache.RECORD.pack(self.shas[idx*20:idx*20+20], self.parents[idx], self.dates[idx], self.depths[idx]))
+            f.flush()
+            f.seek(0)
+            f.write(GraphCache.HEADER.pack(GraphCache.MAGIC, GraphCache.VERSION, count))
+        self.saved = count
+        self.rebuilt = False
+
+    # forget every commit, keeping the settings
+    def clear(self):
+        (jobs, merges) = (self.jobs, self.merges)
+        GraphStore.__init__(self)
+        (self.jobs, self.merges) = (jobs, merges)
+        self.saved = 0
+
+    # start over from what is in f and add back the commits we hadn't
+    # saved that it doesn't have
+    def merge(self, f):
+        unsaved = [(self.hexsha(idx), None if self.parents[idx] < 0 else self.hexsha(self.parents[idx]), self.dates[idx], self.depths[idx])
+                   for idx in range(self.saved, len(self))]
+        self.clear()
+        f.seek(0)
+        self.parse(f.read())
+        pending = []
+        for (hexsha, parent, date, depth) in unsaved:
+            if self.lookup(hexsha) is None:
+                idx = self.add(hexsha, date)
+                self.depths[idx] = depth
+                pending.append((idx, parent))
+        for (idx, parent) in pending:
+            self.parents[idx] = -1 if parent is None else self.lookup(parent)
+
+    # make sure the first-parent history of every tip is in the cache.
+    # Returns the number of commits that had to be read from git.  If
+    # git has pruned commits the cache ends at, the cache is read again
+    # from scratch and the next save replaces the file.
+    def update(self, repodir, tips):
+        missing = [tip for tip in tips if self.lookup(tip) is None]
+        instrument.hits("graph cache tips", len(tips) - len(missing), len(missing))
+        added = GraphStore.update(self, repodir, tips)
+        if added is None:
+            print("Rebuilding graph cache {}, some of its commits are gone from the repo".format(self.path))
+            self.clear()
+            self.rebuilt = True
+            added = GraphStore.update(self, repodir, tips)
+        return added
@@ -0,0 +1,138 @@
+# Stream the tree bgraph shows to a file for other programs, instead
+# of drawing it.  The tree is the same one: chains of unnamed commits
+# collapsed into the node above them, numbered in preorder so a node's
+# parent always comes before it.  Node records are written as the tree
+# is walked and segment records (the files a branch changed) as
+# diff-tree produces them, so memory doesn't grow with the output.
+#
+# JSON Lines: one object per line, with "type" one of
+#   graph    root, merges, segments
+#   node     id, parent (null for the root), sha, tip (the last commit
+#            of a collapsed chain, where children hang off), skipped,
+#            name (null if unnamed), depth, date, merged (sha of the
+#            merge that brought it in, or null)
+#   segment  node, name, from, to, files
+#
+# Binary: the header "GUGX", version (uint16) and flags (uint8, 1 if
+# merges were read), then records that each start with a type byte:
+#   N  parent (int32, -1 for the root), sha, tip (20 bytes each),
+#      depth (int32), date (int64), skipped (int32), merge sha (20
+#      bytes, zero if not merged), name
+#   S  node (int32), from and to shas (20 bytes each), file count
+#      (uint32), that many names
+#   E  end of the export
+# Nodes are numbered in the order they appear.  Names are a uint16
+# byte length and utf-8, an empty name means an unnamed node.  All
+# numbers are little endian.
+
+import json
+import struct
+
+NOSHA = bytes(20)
+
+
+class JsonLinesExport:
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, record):
+        self.out.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+
+    def begin(self, root, merges, segments):
+        self.write({"type": "graph", "root": root, "merges": merges, "segments": segments})
+
+    def node(self, number, parent, hexsha, tip, skipped, name, depth, date, merge):
+        self.write({"type": "node", "id": number, "parent": None if parent < 0 else parent, "sha": hexsha, "tip": tip,
+                    "skipped": skipped, "name": name, "depth": depth, "date": date, "merged": merge})
+
+    def segment(self, number, name, base, tip, files):
+        self.write({"type": "segment", "node": number, "name": name, "from": base, "to": tip, "files": files})
+
+    def end(self):
+        self.out.flush()
+
+
+class BinaryExport:
+    MAGIC = b"GUGX"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHB")
+    NODE = struct.Struct("<ci20s20siqi20s")
+    SEGMENT = struct.Struct("<ci20s20sI")
+    NAME = struct.Struct("<H")
+
+    def __init__(self, out):
+        self.out = out
+
+    def name(self, name):
+        data = (name or "").encode()
+        return BinaryExport.NAME.pack(len(data)) + data
+
+    def begin(self, root, merges, segments):
+        self.out.write(BinaryExport.HEADER.pack(BinaryExport.MAGIC, BinaryExport.VERSION, 1 if merges else 0))
+
+    def node(self, number, parent, hexsha, tip, skipped, name, depth, date, merge):
+        self.out.write(BinaryExport.NODE.pack(b"N", parent, bytes.fromhex(hexsha), bytes.fromhex(tip), depth, date, skipped,
+                                              NOSHA if merge is None else bytes.fromhex(merge)))
+        self.out.write(self.name(name))
+
+    def segment(self, number, name, base, tip, files):
+        self.out.write(BinaryExport.SEGMENT.pack(b"S", number, bytes.fromhex(base), bytes.fromhex(tip), len(files)))
+        self.out.write(b"".join(self.name(x) for x in files))
+
+    def end(self):
+        self.out.write(b"E")
+        self.out.flush()
+
+
+# write the tree below root to writer.  names is {id: name}, merged
+# and reached are what store.mergesBelow gave (or {} and None without
+# merges).  Segments are diffed like bgraph does it for segmentMode,
+# and with remember their file lists are kept in fileChanges for the
+# next export (when bgraph is watching).
+def exportGraph(writer, store, root, names, merged, reached, fileChanges, segmentMode, remember=False):
+    writer.begin(store.hexsha(root), reached is not None, segmentMode)
+    # the nodes, remembering just the named ones for the segments
+    named = []
+    number = 0
+    todo = [(root, -1)]
+    while len(todo) > 0:
+        (top, parent) = todo.pop()
+        (idx, skipped) = store.chainEnd(top, names)
+        merge = merged.get(top)
+        writer.node(number, parent, store.hexsha(top), store.hexsha(idx), skipped, names.get(top),
+                    store.depths[top], store.dates[top], None if merge is None else store.hexsha(merge))
+        if top in names:
+            named.append((number, top))
+        for child in reversed(store.children(idx)):
+            todo.append((child, number))
+        number += 1
+    # then what changed in each branch, in the same order
+    segments = []
+    for (number, tip) in named:
+        if segmentMode == "tree":
+            base = store.segmentStart(tip, names, reached)
+        else:
+            base = store.splitPoint(tip, names)
+        if base >= 0:
+            segments.append((number, tip, base))
+    if segmentMode == "tree":
+        files = fileChanges.streamSegments(((store.hexsha(base), store.hexsha(tip)) for (number, tip, base) in segments), remember)
+        for ((number, tip, base), changed) in zip(segments, files):
+            writer.segment(number, names[tip], store.hexsha(base), store.hexsha(tip), sorted(changed))
+    else:
+        # every commit of every segment in one diff-tree, in order
+        def commits():
+            for (number, tip, base) in segments:
+                for idx in store.chain(tip):
+                    if idx == base:
+                        break
+                    parent = store.parents[idx]
+                    yield (store.hexsha(idx), None if parent < 0 else store.hexsha(parent))
+        diffs = fileChanges.diffTree(commits())
+        for (number, tip, base) in segments:
+            files = set()
+            for count in range(store.depths[tip] - store.depths[base]):
+                files.update(next(diffs)[1])
+            writer.segment(number, names[tip], store.hexsha(base), store.hexsha(tip), sorted(files))
+    writer.end()
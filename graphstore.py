@@ -0,0 +1,499 @@
+# Compact first-parent commit graph.  Each commit gets a dense integer
+# id and everything about it lives in typed arrays indexed by that id:
+# raw sha, first parent (-1 for a root), committer date and depth.
+# Children are kept CSR style: the children of id are
+# childList[childStart[id]:childStart[id+1]].  Nothing here makes a
+# Python object per commit except the sha -> id index.
+#
+# With merges set the other parents of merge commits are kept too
+# (mergeList[mergeStart[id]:mergeStart[id+1]]) and every commit gets a
+# generation number: one more than the highest generation of its
+# parents.  A commit can only reach commits of a lower generation, so
+# walks looking for one commit never have to go below its generation.
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import gitstream
+
+NOPARENT = bytes(20)
+
+
+class GraphStore:
+
+    def __init__(self):
+        self.shas = bytearray()
+        self.parents = array('i')
+        self.dates = array('q')
+        self.depths = array('i')
+        self.index = {}
+        self.childStart = array('i')
+        self.childList = array('i')
+        # number of processes to walk chains with
+        self.jobs = 1
+        # read every parent, not just the first
+        self.merges = False
+        self.mergeStart = array('i')
+        self.mergeList = array('i')
+        self.generations = array('i')
+        self.mergePending = []
+        # the commit readHistory(bounded=True) stopped at, if it did
+        self.bound = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    def lookup(self, hexsha):
+        return self.index.get(bytes.fromhex(hexsha))
+
+    def hexsha(self, idx):
+        return self.shas[idx*20:idx*20+20].hex()
+
+    # yield idx and then each of its first-parent ancestors
+    def chain(self, idx):
+        while idx >= 0:
+            yield idx
+            idx = self.parents[idx]
+
+    # add a commit whose parent isn't known yet, return its id
+    def add(self, hexsha, date):
+        sha = bytes.fromhex(hexsha)
+        self.index[sha] = len(self.parents)
+        self.shas += sha
+        self.parents.append(-1)
+        self.dates.append(date)
+        self.depths.append(-1)
+        return self.index[sha]
+
+    # fill the store with everything reachable by first parent from
+    # tips using a single rev-list.  If bounded, only read back to where
+    # the tips meet, so the cost depends on how far they have diverged
+    # rather than on the age of the repo.  Depths are then counted from
+    # that meeting point.
+    def readHistory(self, repodir, tips, bounded=False):
+        pending = []
+        heads = list(tips)
+        bound = sampledMergeBase(repodir, heads) if bounded and len(heads) > 0 else None
+        while bound is not None:
+            self.readChains(repodir, heads + ["^{}".format(bound)], pending)
+            # A chain can pass the merge-base without going through it
+            # (it reached it through a merge).  Those chains stop short,
+            # and tips outside the sample that are below the merge-base
+            # aren't read at all, so move the bound back to where they
+            # meet and read on.
+            dangling = {parent for (idx, parent) in pending if self.lookup(parent) is None and parent != bound}
+            dangling.update(tip for tip in tips if self.lookup(tip) is None and tip != bound)
+            if len(dangling) == 0:
+                # the bound itself, but none of its parents
+                for (hexsha, date, parents) in gitstream.firstParents(repodir, [bound]):
+                    self.add(hexsha, date)
+                    break
+                self.bound = bound
+                break
+            heads = sorted(dangling) + [bound]
+            bound = sampledMergeBase(repodir, heads[:-1], bound)
+        else:
+            # not bounded, or the chains have nothing in common
+            self.readChains(repodir, heads, pending)
+        self.linkParents(pending)
+        self.fillDepths()
+
+    # commits nobody in the store lists as first parent
+    def leaves(self):
+        haschild = bytearray(len(self))
+        for parent in self.parents:
+            if parent >= 0:
+                haschild[parent] = 1
+        return [idx for idx in range(len(self)) if not haschild[idx]]
+
+    # add what the tips need that the store doesn't have.  Returns the
+    # number of commits read from git, or None if some of it doesn't
+    # join what is there (a store read back to a bound and a tip that
+    # forks below it) or git no longer has commits we would exclude (a
+    # deleted or rewritten branch that gc pruned).  Then the store is
+    # only half updated, or not at all, and reading again from scratch
+    # is the only way on.
+    def update(self, repodir, tips):
+        missing = [tip for tip in tips if self.lookup(tip) is None]
+        if len(missing) == 0:
+            return 0
+        leaves = [self.hexsha(idx) for idx in self.leaves()]
+        if len(gitstream.missing(repodir, leaves + ([] if self.bound is None else [self.bound]))) > 0:
+            return None
+        first = len(self)
+        pending = []
+        # everything reachable from the store is excluded, so normally
+        # rev-list stops right where the history we have begins
+        exclude = ["^{}".format(hexsha) for hexsha in leaves]
+        below = [] if self.bound is None else ["^{}".format(self.bound)]
+        self.readChains(repodir, missing + exclude, pending)
+        self.followDangling(repodir, pending, below, tips=missing)
+        if any(self.lookup(parent) is None for (idx, parent) in pending) or any(self.lookup(tip) is None for tip in missing):
+            return None
+        self.linkParents(pending)
+        self.fillDepths(first)
+        return len(self) - first
+
+    # (hexsha, date, parents) for every commit rev-list gives for args,
+    # with just the first parent unless merges is set
+    def walk(self, repodir, args):
+        if self.merges:
+            return gitstream.allParents(repodir, args)
+        return gitstream.firstParents(repodir, args)
+
+    # add everything rev-list gives for args that we don't have yet and
+    # remember (id, first parent) pairs in pending.  With more than one
+    # job the tips in args are split over a pool of processes.
+    def readChains(self, repodir, args, pending):
+        tips = [arg for arg in args if not arg.startswith("^")]
+        exclude = [arg for arg in args if arg.startswith("^")]
+        if self.jobs <= 1 or len(tips) < 2:
+            self.addChains(self.walk(repodir, args), pending)
+            return
+        # Most history is shared by all of the tips, so read it once up
+        # front and keep the workers above it.  Workers can still overlap
+        # above it, duplicates are dropped as they are added.
+        base = sampledMergeBase(repodir, tips)
+        if base is not None:
+            self.addChains(self.walk(repodir, [base] + exclude), pending)
+        groups = [tips[i::self.jobs] for i in range(self.jobs)]
+        bounded = exclude if base is None else exclude + ["^{}".format(base)]
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            for packed in pool.map(walkChains, [repodir] * len(groups), [group + bounded for group in groups],
+                                   [self.merges] * len(groups)):
+                self.addChains(unpackChains(*packed), pending)
+        # chains that reached the base's history through a merge, and
+        # tips in the base's history but not on its first-parent chain
+        self.followDangling(repodir, pending, exclude, tips)
+
+    # add the (hexsha, date, [parent]) records we don't have yet
+    def addChains(self, records, pending):
+        for (hexsha, date, parents) in records:
+            if self.lookup(hexsha) is not None:
+                continue
+            idx = self.add(hexsha, date)
+            if len(parents) > 0:
+                pending.append((idx, parents[0]))
+            for parent in parents[1:]:
+                self.mergePending.append((idx, parent))
+
+    # A first-parent chain can stop at history that is only reachable
+    # from what rev-list excluded through a merge's other parents.
+    # Follow those chains on until they join something we have (or
+    # reach what exclude still excludes).  The same goes for tips that
+    # rev-list left out altogether, so those are followed too.
+    def followDangling(self, repodir, pending, exclude=(), tips=()):
+        tried = set()
+        while True:
+            dangling = {parent for (idx, parent) in pending if parent not in tried and self.lookup(parent) is None}
+            dangling.update(tip for tip in tips if tip not in tried and self.lookup(tip) is None)
+            if len(dangling) == 0:
+                return
+            for start in sorted(dangling):
+                tried.add(start)
+                if self.lookup(start) is not None:
+                    continue
+                if self.merges:
+                    # history from here isn't a single chain, so it
+                    # can't stop at the first commit we already have
+                    self.addChains(self.walk(repodir, [start] + list(exclude)), pending)
+                    continue
+                for (hexsha, date, parents) in gitstream.firstParents(repodir, [start] + list(exclude)):
+                    if self.lookup(hexsha) is not None:
+                        break
+                    idx = self.add(hexsha, date)
+                    if len(parents) > 0:
+                        pending.append((idx, parents[0]))
+
+    # point the parents of what was read at their ids.  With merges, also
+    # index the other parents (those that were read, the rest wait for a
+    # later read) and number the generations.
+    def linkParents(self, pending):
+        for (idx, parent) in pending:
+            self.parents[idx] = self.lookup(parent)
+        if not self.merges:
+            return
+        edges = [(idx, parent) for idx in range(len(self.mergeStart) - 1)
+                 for parent in self.mergeList[self.mergeStart[idx]:self.mergeStart[idx+1]]]
+        edges.extend((idx, self.lookup(parent)) for (idx, parent) in self.mergePending if self.lookup(parent) is not None)
+        edges.sort()
+        self.mergePending = [(idx, parent) for (idx, parent) in self.mergePending if self.lookup(parent) is None]
+        counts = array('i', bytes(4 * (len(self) + 1)))
+        for (idx, parent) in edges:
+            counts[idx + 1] += 1
+        for idx in range(len(self)):
+            counts[idx + 1] += counts[idx]
+        self.mergeStart = counts
+        self.mergeList = array('i', (parent for (idx, parent) in edges))
+        self.fillGenerations()
+
+    # every parent of idx that is in the store, first parent first
+    def allParents(self, idx):
+        parents = [] if self.parents[idx] < 0 else [self.parents[idx]]
+        if idx + 1 < len(self.mergeStart):
+            parents.extend(self.mergeList[self.mergeStart[idx]:self.mergeStart[idx+1]])
+        return parents
+
+    # set depth for ids from first on.  No recursion, and each id is
+    # pushed on todo exactly once, so it is linear in the commits added
+    # no matter how long the chains are.
+    def fillDepths(self, first=0):
+        for idx in range(first, len(self)):
+            todo = []
+            while idx >= 0 and self.depths[idx] < 0:
+                todo.append(idx)
+                idx = self.parents[idx]
+            depth = -1 if idx < 0 else self.depths[idx]
+            for idx in reversed(todo):
+                depth += 1
+                self.depths[idx] = depth
+
+    # generation numbers with an explicit stack.  Parents mostly come
+    # after their children, so starting from the oldest end keeps it
+    # shallow.  Parents that weren't read count as generation 0.
+    def fillGenerations(self):
+        self.generations = array('i', bytes(4 * len(self)))
+        for first in range(len(self) - 1, -1, -1):
+            todo = [first]
+            while len(todo) > 0:
+                idx = todo[-1]
+                if self.generations[idx] > 0:
+                    todo.pop()
+                    continue
+                parents = self.allParents(idx)
+                missing = [parent for parent in parents if self.generations[parent] == 0]
+                if len(missing) > 0:
+                    todo.extend(missing)
+                    continue
+                self.generations[idx] = 1 + max((self.generations[parent] for parent in parents), default=0)
+                todo.pop()
+
+    # last commit the first-parent chains of a and b have in common, or
+    # -1 if they have none.  Shared commits are at the same depth on
+    # both chains, so stepping whichever side is deeper only walks the
+    # commits since the fork.
+    def chainBase(self, a, b):
+        while a != b:
+            if a < 0 or b < 0:
+                return -1
+            if self.depths[a] >= self.depths[b]:
+                a = self.parents[a]
+            else:
+                b = self.parents[b]
+        return a
+
+    # chainBase for each (i, j) in pairs, which are positions in tips,
+    # walking the chains of all the tips just once.  Each tip walks down
+    # until it runs into a chain walked before, and records where it
+    # joined it.  Following the joins gives every tip a path of at most
+    # len(tips) pieces, and two tips meet on the first piece their
+    # paths share, at whichever of their two entry points is lower.
+    def chainBases(self, tips, pairs):
+        owner = array('i', [-1]) * len(self)
+        # for each tip, (owner, where its chain enters that owner's piece)
+        paths = []
+        for (number, tip) in enumerate(tips):
+            idx = tip
+            while idx >= 0 and owner[idx] < 0:
+                owner[idx] = number
+                idx = self.parents[idx]
+            path = [(number, tip)]
+            if idx >= 0:
+                path.append((owner[idx], idx))
+                path.extend(paths[owner[idx]][1:])
+            paths.append(path)
+        bases = []
+        for (i, j) in pairs:
+            entries = dict(paths[i])
+            base = -1
+            for (piece, idx) in paths[j]:
+                if piece in entries:
+                    other = entries[piece]
+                    base = idx if self.depths[idx] <= self.depths[other] else other
+                    break
+            bases.append(base)
+        return bases
+
+    # what the merges in the first-parent tree below root bring in.
+    # Returns (reached, merged): reached[id] is set for every commit
+    # the other parents of some merge lead to, and merged is {tip:
+    # merge} for the ids in tips that are reached, crediting the
+    # earliest merge.  Merges are walked lowest generation first with
+    # reached as the seen set, so nothing is walked twice, and nothing
+    # below root's generation is walked at all.  A walk stops at the
+    # merge's own first-parent ancestors: they aren't merged by it, and
+    # whatever is behind them comes in through merges on that chain.
+    def mergesBelow(self, root, tips):
+        tips = set(tips)
+        # preorder numbers of the first-parent tree below root, so
+        # "x is a first-parent ancestor of y" is two comparisons
+        order = array('i', [-1]) * len(self)
+        size = array('i', bytes(4 * len(self)))
+        preorder = []
+        todo = [root]
+        while len(todo) > 0:
+            idx = todo.pop()
+            order[idx] = len(preorder)
+            preorder.append(idx)
+            todo.extend(self.children(idx))
+        for idx in reversed(preorder):
+            size[idx] += 1
+            if idx != root:
+                size[self.parents[idx]] += size[idx]
+        merges = [idx for idx in preorder if self.mergeStart[idx] < self.mergeStart[idx+1]]
+        merges.sort(key=lambda idx: self.generations[idx])
+        lowest = self.generations[root]
+        reached = bytearray(len(self))
+        merged = {}
+        for merge in merges:
+            todo = list(self.mergeList[self.mergeStart[merge]:self.mergeStart[merge+1]])
+            while len(todo) > 0:
+                idx = todo.pop()
+                if reached[idx] or self.generations[idx] < lowest:
+                    continue
+                if order[idx] >= 0 and order[idx] <= order[merge] < order[idx] + size[idx]:
+                    continue
+                reached[idx] = 1
+                if idx in tips:
+                    merged[idx] = merge
+                todo.extend(self.allParents(idx))
+        return (reached, merged)
+
+    # lowest common first-parent ancestor of the ids in tips, or -1 if
+    # they don't share a root.  The first tip's chain is marked, then
+    # every other tip walks up until it reaches something marked.  A
+    # tip that runs into another tip's chain shares that tip's fork, so
+    # the answer is the deepest point of the first chain every other
+    # chain reached, and nothing is walked twice.
+    def forkPoint(self, tips):
+        tips = list(tips)
+        if len(tips) == 0:
+            return -1
+        seen = bytearray(len(self))
+        for idx in self.chain(tips[0]):
+            seen[idx] = 1
+        fork = tips[0]
+        for tip in tips[1:]:
+            idx = tip
+            while idx >= 0 and not seen[idx]:
+                seen[idx] = 2
+                idx = self.parents[idx]
+            if idx < 0:
+                return -1
+            if seen[idx] == 1 and self.depths[idx] < self.depths[fork]:
+                fork = idx
+        return fork
+
+    # follow idx down while it has exactly one child and that child
+    # isn't in names.  Returns (where it stopped, number of steps).
+    def chainEnd(self, idx, names):
+        skipped = 0
+        while self.childStart[idx+1] - self.childStart[idx] == 1:
+            child = self.childList[self.childStart[idx]]
+            if child in names:
+                break
+            idx = child
+            skipped += 1
+        return (idx, skipped)
+
+    # nearest first-parent ancestor of idx that is in names or where
+    # the children index branches, -1 if there is none
+    def splitPoint(self, idx, names):
+        start = self.parents[idx]
+        while start >= 0 and self.numChildren(start) == 1 and start not in names:
+            start = self.parents[start]
+        return start
+
+    # where the diff for the branch at idx starts: its split point, or
+    # given reached (from mergesBelow) the newest commit between the
+    # two that has been merged
+    def segmentStart(self, idx, names, reached=None):
+        start = self.splitPoint(idx, names)
+        if start < 0 or reached is None:
+            return start
+        while idx != start:
+            if reached[idx]:
+                return idx
+            idx = self.parents[idx]
+        return start
+
+    # ids of everything reachable by first parent from tips (ids)
+    def closure(self, tips):
+        seen = bytearray(len(self))
+        result = array('i')
+        for tip in tips:
+            for idx in self.chain(tip):
+                if seen[idx]:
+                    break
+                seen[idx] = 1
+                result.append(idx)
+        return result
+
+    # build the CSR child index, only counting the given ids (default all)
+    def buildChildren(self, ids=None):
+        if ids is None:
+            ids = range(len(self))
+        counts = array('i', bytes(4 * (len(self) + 1)))
+        for idx in ids:
+            parent = self.parents[idx]
+            if parent >= 0:
+                counts[parent + 1] += 1
+        for idx in range(len(self)):
+            counts[idx + 1] += counts[idx]
+        self.childStart = counts
+        self.childList = array('i', bytes(4 * counts[-1]))
+        fill = array('i', counts)
+        for idx in ids:
+            parent = self.parents[idx]
+            if parent >= 0:
+                self.childList[fill[parent]] = idx
+                fill[parent] += 1
+
+    def children(self, idx):
+        return self.childList[self.childStart[idx]:self.childStart[idx+1]]
+
+    def numChildren(self, idx):
+        return self.childStart[idx+1] - self.childStart[idx]
+
+
+# An octopus merge-base of thousands of tips costs more than walking
+# them, so take the merge-base of an evenly spread sample plus keep (a
+# previous bound).  Tips outside the sample may fork below it, so
+# callers have to cope with chains that pass it.
+def sampledMergeBase(repodir, commits, keep=None):
+    sample = list(commits[::max(1, len(commits) // 8)])
+    if keep is not None:
+        sample.append(keep)
+    return gitstream.mergeBase(repodir, sample)
+
+
+# runs in a worker process: walk the first-parent chains for args and
+# hand back raw shas, first parents and dates packed into bytes, which
+# is much cheaper to send back than a tuple per commit
+def walkChains(repodir, args, merges=False):
+    shas = bytearray()
+    parents = bytearray()
+    dates = array('q')
+    others = array('i')
+    walk = gitstream.allParents if merges else gitstream.firstParents
+    for (hexsha, date, parentlist) in walk(repodir, args):
+        shas += bytes.fromhex(hexsha)
+        parents += bytes.fromhex(parentlist[0]) if len(parentlist) > 0 else NOPARENT
+        dates.append(date)
+        others.append(max(len(parentlist) - 1, 0))
+        for parent in parentlist[1:]:
+            parents += bytes.fromhex(parent)
+    return (bytes(shas), bytes(parents), dates.tobytes(), others.tobytes())
+
+
+# turn what walkChains packed back into (hexsha, date, parents) records
+def unpackChains(shas, parents, dates, others):
+    dates = array('q', dates)
+    others = array('i', others)
+    offset = 0
+    for i in range(len(dates)):
+        parentlist = [] if parents[offset:offset+20] == NOPARENT else [parents[offset:offset+20].hex()]
+        offset += 20
+        for j in range(others[i]):
+            parentlist.append(parents[offset:offset+20].hex())
+            offset += 20
+        yield (shas[i*20:i*20+20].hex(), dates[i], parentlist)
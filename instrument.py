@@ -0,0 +1,149 @@
+# Where the time goes, for the --profile flag of the scripts here.
+# Scripts wrap their phases in `with instrument.phase("name"):` and
+# the helpers count what they do (git processes, API calls, cache hits
+# and misses).  Counting is always on since it is only a dict update;
+# enable() makes the report come out when the script exits, as a table
+# on stderr or as JSON that can be kept and compared over time.
+#
+# Phases can nest, each one is timed on its own, so the times of nested
+# phases are also part of the phase around them.  "git cpu" is the CPU
+# time of child processes that finished during the phase, which is
+# mostly git.
+
+import atexit
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# name -> [calls, wall, cpu, child cpu], in the order first seen
+phases = {}
+counters = {}
+# name -> [hits, misses]
+caches = {}
+loaded = time.perf_counter()
+enabled = False
+# counts can come from worker threads
+lock = threading.Lock()
+
+
+# seconds since the process started, so the total includes what was
+# imported before this module.  Since this module loaded if /proc
+# can't tell us.
+def elapsed():
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, AttributeError):
+        return time.perf_counter() - loaded
+
+
+def childCpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+@contextmanager
+def phase(name):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    child = childCpu()
+    try:
+        yield
+    finally:
+        totals = phases.setdefault(name, [0, 0.0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += time.perf_counter() - wall
+        totals[2] += time.process_time() - cpu
+        totals[3] += childCpu() - child
+
+
+def count(name, n=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+# record hits and misses of the cache called name
+def hits(name, hit, miss=0):
+    with lock:
+        totals = caches.setdefault(name, [0, 0])
+        totals[0] += hit
+        totals[1] += miss
+
+
+# count every call of method on cls as name (e.g., the one method all
+# of a library's requests go through)
+def countCalls(cls, method, name):
+    original = getattr(cls, method)
+
+    def counted(*args, **kwargs):
+        count(name)
+        return original(*args, **kwargs)
+    setattr(cls, method, counted)
+
+
+def results():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall = elapsed()
+    return {
+        "script": os.path.basename(sys.argv[0]),
+        "started": time.time() - wall,
+        "wall": wall,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "child cpu": children.ru_utime + children.ru_stime,
+        # ru_maxrss is in KB on Linux
+        "peak rss mb": usage.ru_maxrss / 1024,
+        "peak child rss mb": children.ru_maxrss / 1024,
+        "phases": {name: {"calls": calls, "wall": wall, "cpu": cpu, "git cpu": child}
+                   for (name, (calls, wall, cpu, child)) in phases.items()},
+        "counts": dict(counters),
+        "caches": {name: {"hits": hit, "misses": miss, "rate": hit / (hit + miss) if hit + miss > 0 else None}
+                   for (name, (hit, miss)) in caches.items()},
+    }
+
+
+def table(out, data):
+    out.write("{:24} {:>6} {:>9} {:>9} {:>9}\n".format("phase", "calls", "wall s", "cpu s", "git cpu s"))
+    for (name, totals) in data["phases"].items():
+        out.write("{:24} {:>6} {:>9.3f} {:>9.3f} {:>9.3f}\n".format(name, totals["calls"], totals["wall"], totals["cpu"], totals["git cpu"]))
+    out.write("{:24} {:>6} {:>9.3f} {:>9.3f} {:>9.3f}\n".format("total", "", data["wall"], data["cpu"], data["child cpu"]))
+    for (name, n) in sorted(data["counts"].items()):
+        out.write("{:24} {:>6}\n".format(name, n))
+    for (name, totals) in data["caches"].items():
+        rate = "-" if totals["rate"] is None else "{:.1%}".format(totals["rate"])
+        out.write("{:24} {:>6} hits {:>6} misses {:>6}\n".format(name, totals["hits"], totals["misses"], rate))
+    out.write("peak rss {:.1f}MB (children {:.1f}MB)\n".format(data["peak rss mb"], data["peak child rss mb"]))
+
+
+def report(jsonPath=""):
+    data = results()
+    if jsonPath != "":
+        with open(jsonPath, "w") as f:
+            json.dump(data, f, indent=1)
+            f.write("\n")
+    else:
+        table(sys.stderr, data)
+
+
+# report when the script exits: to jsonPath if given, else as a table
+def enable(jsonPath=""):
+    global enabled
+    if not enabled:
+        enabled = True
+        atexit.register(report, jsonPath)
+
+
+# the --profile flags every script takes
+def addArguments(parser):
+    parser.add_argument("--profile", action="store_true", help="print where the time went when done")
+    parser.add_argument("--profile-json", default="", help="write where the time went to this file as JSON")
+
+
+def fromArguments(args):
+    if args.profile or args.profile_json != "":
+        enable(args.profile_json)
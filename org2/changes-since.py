@@ -2,18 +2,27 @@
 
 # https://pygithub.readthedocs.io/en/latest/introduction.html
 
-from github import Github, NamedUser
+from github import Github, NamedUser, Requester
 import os
 import sys
 from datetime import datetime, timedelta
 import pytz
 from tzlocal import get_localzone 
-import argparser
+import argparse
 from pprint import pprint
 import webbrowser
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import instrument
+import ghfetch
+import ghcache
+import ghlimit
+import ghgraphql
 
-parser = argparser.ArgumentParser(description="show activity on an org since a given date")
+# every API request goes through here
+instrument.countCalls(Requester.Requester, "requestJsonAndCheck", "github api")
+
+parser = argparse.ArgumentParser(description="show activity on an org since a given date")
 parser.add_argument('-s', '--since', default="", help='starting date')
 parser.add_argument('-d', '--details', action="store_true", help='show details')
 parser.add_argument('-l', '--showlinks', action="store_true", help='show links')
@@ -25,7 +34,14 @@ parser.add_argument('-i', '--showissues', action="store_true", help='show issues
 parser.add_argument('-p', '--days', type=int, default=1, help='how many days back to go')
 parser.add_argument('-m', '--minutes', type=int, default=-1, help='how many minutes to go back (-1 to ignore)')
 parser.add_argument('-a', '--afterme', action="store_true", help='do not include PRs where my activity was last')
+parser.add_argument('-j', '--jobs', type=int, default=8, help='most API requests in flight at once')
+parser.add_argument('--api-url', default='https://api.github.com', help='GitHub API to use (e.g., a local mock server)')
+parser.add_argument('-g', '--graphql', action="store_true", help='get PRs with their comments and commits from the GraphQL API (far fewer requests)')
+ghcache.addArguments(parser)
+ghlimit.addArguments(parser)
+instrument.addArguments(parser)
 args = parser.parse_args()
+instrument.fromArguments(args)
 since = None
 if args.since != "":
     if len(args.since) > 5:
@@ -99,7 +115,7 @@ usermap = {
 }
 
 def nicename(name, login):
-    if isinstance(name, NamedUser.NamedUser):
+    if isinstance(name, (NamedUser.NamedUser, ghgraphql.User)):
         name = name.name
     if name in usermap:
         return usermap[name]
@@ -131,14 +147,125 @@ def brief(body):
         return body
     return body[0:40]+"..."
 
+################################################################
+# fetching.  Each of these runs on a fetcher thread and gives back
+# what to print, which the main thread prints in order.
+
+
+# lines for an issue
+def showIssue(issue):
+    lines = ["Issue:\t{} on {} update:{}".format(issue.title, issue.repository.name, issue.updated_at)]
+    if showlinks:
+        lines.append("\tlink:{}".format(issue.html_url))
+    assignees = [nicename(assignee.name, assignee.login) for assignee in issue.assignees]
+    lines.append("\t" + ", ".join(assignees) if len(assignees) > 0 else "")
+    for label in issue.get_labels():
+        lines.append("\t{}".format(label.name))
+    return lines
+
+
+# (lines for the commits since since, [(PR, showPR job)] for the PRs
+# updated since since) of repo.  The PRs are started on as soon as they
+# are listed, not when the repos before this one have been printed.
+def listRepo(repo):
+    lines = []
+    if showcommits:
+        commits = list(repo.get_commits(since=since))
+        # the files of each commit are a request of their own
+        for (commit, files) in zip(commits, fetcher.map(lambda commit: commit.files, commits)):
+            author = "?" if commit.author is None else commit.author.login
+            if author == "?":
+                author = commit.commit.author.name
+            lines.append("Commit\t{:10}\t{:7}\t{}\n\t{}".format(repo.name, nicename(author, None), commit.commit.author.date,
+                                                                commit.commit.message.replace("\n", "\n\t")))
+            for file in files:
+                lines.append("\t\t\t+{} -{}\t{}".format(file.additions, file.deletions, file.filename))
+    if graphql is not None:
+        # newest first, like get_pulls()
+        prs = sorted(graphql.pulls(repo, ["OPEN"], since), key=lambda pr: pr.created_at, reverse=True)
+    else:
+        prs = [pr for pr in repo.get_pulls() if pr.updated_at >= since]
+    return (lines, [(pr, fetcher.submit(showPR, repo, pr)) for pr in prs])
+
+
+# a MaybePrint for a PR
+def showPR(repo, pr):
+    pout = MaybePrint()
+    user = pr.user
+    pout.print("PR {}:{:16} {} {:6} {:4} '{}' by {}".format(repo.name, bname(pr.head.label), pr.updated_at, pr.mergeable_state, pr.state,
+                                                    pr.title, nicename(user.name, user.login)))
+    if showlinks:
+        pout.print("\tlink:{}".format(pr.html_url))
+
+    # the comments and commits of the PR are separate requests
+    reviews = fetcher.leaf(lambda: list(pr.get_comments()))
+    comments = fetcher.leaf(lambda: list(pr.get_issue_comments()))
+    commits = list(pr.get_commits())
+    commits = [commit for commit in commits if commit.commit.author.date >= since]
+    files = fetcher.map(lambda commit: commit.files, commits)
+    if details:
+        pout.print("\tcomments:{}, commits:{}, +{} -{}".format(pr.comments, pr.commits, pr.additions, pr.deletions))
+        for comment in reviews.result():
+            if comment.created_at >= since:
+                nn = nicename(comment.user, None)
+                pout.checkActivity(nn, comment.created_at)
+                pout.print("\tRC:{} {}\n\t{}".format(comment.created_at, nn, comment.body.replace('\n', '\n\t')))
+        for comment in comments.result():
+            if comment.created_at >= since:
+                nn = nicename(comment.user, None)
+                pout.checkActivity(nn, comment.created_at)
+                pout.print("\tIC:{} {}\n\t{}".format(comment.created_at, nicename(comment.user, None), comment.body.replace('\n', '\n\t')))
+        sfiles = {}
+        for (commit, changed) in zip(commits, files):
+            author = "?" if commit.author is None else commit.author.login
+            if author == "?":
+                author = commit.commit.author.name
+            nn = nicename(author, None)
+            pout.checkActivity(nn, commit.commit.author.date)
+            pout.print("\tCommit\t{:7}\t{}\n\t{}".format(nn, commit.commit.author.date,
+                                                     commit.commit.message.replace("\n", "\n\t")))
+            for file in changed:
+                pout.print("\t\t+{} -{}\t{}".format(file.additions, file.deletions, file.filename))
+                sfiles[file] = 1
+    else:
+        for comment in comments.result():
+            if comment.created_at >= since:
+                nn = nicename(comment.user, None)
+                pout.checkActivity(nn, comment.created_at)
+                pout.print("\tIC\t{:7}\t{}\t{}".format(nicename(comment.user, None), comment.created_at, brief(comment.body)))
+        for comment in reviews.result():
+            if comment.created_at >= since:
+                nn = nicename(comment.user, None)
+                pout.checkActivity(nn, comment.created_at)
+                pout.print("\tRC\t{:7}\t{}\t{}".format(nicename(comment.user, None), comment.created_at, brief(comment.body)))
+        sfiles = {}
+        for (commit, changed) in zip(commits, files):
+            for file in changed:
+                sfiles[file.filename] = 1
+            author = "?" if commit.author is None else commit.author.login
+            if author == "?":
+                author = commit.commit.author.name
+            nn = nicename(author, None)
+            pout.checkActivity(nn, commit.commit.author.date)
+            pout.print("\tCommit\t{:7}\t{}\t{}\t{}".format(nn, commit.commit.author.date,
+                                                       len(sfiles.keys()), brief(commit.commit.message)))
+    return pout
+
+
 ################################################################
 # main entry
 
-accessToken = getFromEnv('GITHUBPAT')
+# one token, or several separated by commas to share the rate limit
+tokens = getFromEnv('GITHUBPAT').split(',')
 
 # using an access token
-gh = Github(accessToken)
-org = gh.get_organization(orgname)
+cache = ghcache.fromArguments(args)
+ghfetch.setup(args.jobs, cache, ghlimit.fromArguments(args, tokens))
+fetcher = ghfetch.Fetcher(args.jobs)
+gh = Github(tokens[0], base_url=args.api_url, pool_size=args.jobs)
+graphql = ghgraphql.Client(gh, args.api_url) if args.graphql else None
+with instrument.phase("org"):
+    org = gh.get_organization(orgname)
 browserOpened = 1               # if opening web pages, 1 means new window, 2 means new tab in last window
 
 if False:
@@ -147,100 +274,28 @@ if False:
         print("Repo: {}".format(repo.name))
 
 if showissues:
-    print("Issues Changed since {}".format(since))
-    issues = org.get_issues(since=since)
-    for issue in issues:
-        print("Issue:\t{} on {} update:{}".format(issue.title, issue.repository.name, issue.updated_at))
-        if showlinks:
-            print("\tlink:{}".format(issue.html_url))
-        sepr = "\t"
-        for assignee in issue.assignees:
-            sys.stdout.write("{}{}".format(sepr, nicename(assignee.name, assignee.login)))
-            sepr = ", "
-        sys.stdout.write("\n")
-        for label in issue.get_labels():
-            print("\t{}".format(label.name))
-
-repos = org.get_repos()
-for repo in repos:
-    if reponame is not None and reponame != repo.name:
-        continue
-    if showcommits:
-        for commit in repo.get_commits(since=since):
-            author = "?" if commit.author is None else commit.author.login
-            if author == "?":
-                author = commit.commit.author.name
-            print("Commit\t{:10}\t{:7}\t{}\n\t{}".format(repo.name, nicename(author, None), commit.commit.author.date,
-                                                         commit.commit.message.replace("\n", "\n\t")))
-            for file in commit.files:
-                print("\t\t\t+{} -{}\t{}".format(file.additions, file.deletions, file.filename))
-            
-    for pr in repo.get_pulls():
-        if pr.updated_at >= since:
-            doprint = False if afterme else True
-            pout = MaybePrint()
-            user = pr.user
-            pout.print("PR {}:{:16} {} {:6} {:4} '{}' by {}".format(repo.name, bname(pr.head.label), pr.updated_at, pr.mergeable_state, pr.state, 
-                                                            pr.title, nicename(user.name, user.login)))
-            if showlinks:
-                pout.print("\tlink:{}".format(pr.html_url))
+    with instrument.phase("issues"):
+        print("Issues Changed since {}".format(since))
+        issues = org.get_issues(since=since)
+        for job in [fetcher.submit(showIssue, issue) for issue in issues]:
+            for line in job.result():
+                print(line)
+
+# everything is asked for up front, then printed in order as it arrives
+with instrument.phase("repos"):
+    repos = [repo for repo in org.get_repos() if reponame is None or reponame == repo.name]
+    listings = [fetcher.submit(listRepo, repo) for repo in repos]
+with instrument.phase("pull requests"):
+    for (repo, listing) in zip(repos, listings):
+        (lines, jobs) = listing.result()
+        for line in lines:
+            print(line)
+        for (pr, job) in jobs:
             if openweb:
                 # open in new window first time, then in new tab for each other time
                 webbrowser.open(pr.html_url, new=browserOpened)
                 browserOpened = 2
-
-            if details:
-                pout.print("\tcomments:{}, commits:{}, +{} -{}".format(pr.comments, pr.commits, pr.additions, pr.deletions))
-                reviews = pr.get_comments()
-                for comment in reviews:
-                    if comment.created_at >= since:
-                        nn = nicename(comment.user, None)
-                        pout.checkActivity(nn, comment.created_at)
-                        pout.print("\tRC:{} {}\n\t{}".format(comment.created_at, nn, comment.body.replace('\n', '\n\t')))
-                comments = pr.get_issue_comments()
-                for comment in comments:
-                    if comment.created_at >= since:
-                        nn = nicename(comment.user, None)
-                        pout.checkActivity(nn, comment.created_at)
-                        pout.print("\tIC:{} {}\n\t{}".format(comment.created_at, nicename(comment.user, None), comment.body.replace('\n', '\n\t')))
-                commits = pr.get_commits()
-                sfiles = {}
-                for commit in commits:
-                    if commit.commit.author.date >= since:
-                        author = "?" if commit.author is None else commit.author.login
-                        if author == "?":
-                            author = commit.commit.author.name
-                        nn = nicename(author, None)
-                        pout.checkActivity(nn, commit.commit.author.date)
-                        pout.print("\tCommit\t{:7}\t{}\n\t{}".format(nn, commit.commit.author.date,
-                                                                 commit.commit.message.replace("\n", "\n\t")))
-                        for file in commit.files:
-                            pout.print("\t\t+{} -{}\t{}".format(file.additions, file.deletions, file.filename))
-                            sfiles[file] = 1
-            else:
-                comments = pr.get_issue_comments()
-                for comment in comments:
-                    if comment.created_at >= since:
-                        nn = nicename(comment.user, None)
-                        pout.checkActivity(nn, comment.created_at)
-                        pout.print("\tIC\t{:7}\t{}\t{}".format(nicename(comment.user, None), comment.created_at, brief(comment.body)))
-                comments = pr.get_comments()
-                for comment in comments:
-                    if comment.created_at >= since:
-                        nn = nicename(comment.user, None)
-                        pout.checkActivity(nn, comment.created_at)
-                        pout.print("\tRC\t{:7}\t{}\t{}".format(nicename(comment.user, None), comment.created_at, brief(comment.body)))
-                sfiles = {}
-                commits = pr.get_commits()
-                for commit in commits:
-                    if commit.commit.author.date >= since:
-                        for file in commit.files:
-                            sfiles[file.filename] = 1
-                        author = "?" if commit.author is None else commit.author.login
-                        if author == "?":
-                            author = commit.commit.author.name
-                        nn = nicename(author, None)
-                        pout.checkActivity(nn, commit.commit.author.date)
-                        pout.print("\tCommit\t{:7}\t{}\t{}\t{}".format(nn, commit.commit.author.date, 
-                                                                   len(sfiles.keys()), brief(commit.commit.message)))
-            pout.maybePrint()
+            job.result().maybePrint()
+fetcher.close()
+if cache is not None:
+    cache.close()
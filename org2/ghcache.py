@@ -0,0 +1,156 @@
+# A disk cache of GitHub API responses for the org2 scripts.  GitHub
+# sends an ETag (and often a Last-Modified) with each response, and a
+# request that sends them back gets an empty 304 Not Modified if
+# nothing changed, which doesn't count against the rate limit.  Most
+# of what the scripts read (the repo list, closed PRs, old comments)
+# doesn't change from one run to the next, so a second run is mostly
+# 304s.
+#
+# Each response is a JSON file named by a hash of the URL, Accept
+# header and token, so one token's private data is never served for
+# another's.  Files not used in --cache-days are removed, and then the
+# least recently used ones until the cache is under --cache-size.  A
+# file's mtime is when it was last used.
+#
+# ghfetch's connections call get() before a GET and put() or
+# notModified() after.  Hits and misses show up in --profile.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import instrument
+
+DEFAULTDIR = os.path.join(os.path.expanduser("~"), ".cache", "gitutils", "github")
+
+
+def addArguments(parser):
+    parser.add_argument("--cache", default=DEFAULTDIR, help="directory to keep API responses in")
+    parser.add_argument("--nocache", action="store_true", help="do not use or update the API response cache")
+    parser.add_argument("--cache-size", type=int, default=200, help="most MB the API response cache may use")
+    parser.add_argument("--cache-days", type=int, default=30, help="drop API responses not used in this many days")
+
+
+# the ResponseCache the arguments ask for, or None
+def fromArguments(args):
+    if args.nocache:
+        return None
+    return ResponseCache(args.cache, args.cache_size * 1024 * 1024, args.cache_days * 24 * 3600)
+
+
+# a response from the cache, looking like PyGithub's RequestsResponse
+class CachedResponse:
+
+    def __init__(self, status, headers, text):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.text
+
+
+class ResponseCache:
+
+    def __init__(self, path, maxBytes, maxAge):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # responses can hold private repos' PRs and comments, so only
+        # the user gets to read them (a cache made before this may
+        # still be open to others)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+
+    @staticmethod
+    def key(url, headers):
+        token = (headers or {}).get("Authorization", "")
+        accept = (headers or {}).get("Accept", "")
+        return hashlib.sha256("{}\n{}\n{}".format(url, accept, token).encode()).hexdigest()
+
+    # the cached entry for key, or None
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # headers to make the request for entry conditional
+    @staticmethod
+    def conditions(entry):
+        headers = {}
+        if entry.get("etag") is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified") is not None:
+            headers["If-Modified-Since"] = entry["lastModified"]
+        return headers
+
+    # keep a 200 that can be asked for again conditionally, and count
+    # the miss
+    def put(self, key, status, headers, text):
+        etag = headers.get("ETag")
+        lastModified = headers.get("Last-Modified")
+        with self.lock:
+            self.misses += 1
+        if status != 200 or (etag is None and lastModified is None):
+            return
+        entry = {"headers": dict(headers), "text": text, "etag": etag, "lastModified": lastModified}
+        # written whole and then renamed, so other threads (and runs)
+        # never see half of it
+        temp = os.path.join(self.path, "{}.{}.tmp".format(key, threading.get_ident()))
+        with os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(entry, f)
+        os.replace(temp, os.path.join(self.path, key))
+
+    # the response for a 304 to the conditional request for entry: what
+    # we have, with the rate limit etc. headers of the 304
+    def notModified(self, key, entry, headers):
+        with self.lock:
+            self.hits += 1
+        try:
+            os.utime(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+        merged = dict(entry["headers"])
+        for (name, value) in headers.items():
+            if name.lower().startswith("x-ratelimit") or name.lower() == "date":
+                merged[name] = value
+        return CachedResponse(200, merged, entry["text"])
+
+    # drop what's too old, then the least recently used until small
+    # enough, and report the hits and misses
+    def close(self):
+        instrument.hits("api responses", self.hits, self.misses)
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.path):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    # unless it's old, another run is writing it
+                    if now - stat.st_mtime > 3600:
+                        os.remove(entry.path)
+                elif now - stat.st_mtime > self.maxAge:
+                    os.remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                # another run got there first
+                pass
+        size = sum(fsize for (mtime, fsize, path) in files)
+        for (mtime, fsize, path) in sorted(files):
+            if size <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= fsize
@@ -0,0 +1,167 @@
+# Fetch from the GitHub API on several threads for the org2 scripts.
+# PyGithub makes one blocking request at a time, so an org with a few
+# hundred repos spends nearly all its time waiting on round trips.
+# Scripts hand the work for each repo, PR, etc. to a Fetcher, which
+# runs it on a thread pool and gives back futures, and then print the
+# results in the order they asked for them so the output doesn't
+# depend on which request finished first.
+#
+# setup() has to be called before the Github object is made.  It
+# limits how many requests are in flight at once, and replaces
+# PyGithub's connections, which keep the request being made on a
+# single shared object and so can't be used from more than one thread.
+# Given a ghcache.ResponseCache, the connections also make GETs
+# conditional on what it has, and given a ghlimit.Scheduler, they wait
+# for it before each request and make it on the token it picks.
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from github import Requester
+import ghlimit
+
+sessions = threading.local()
+cache = None
+scheduler = None
+
+
+# one requests session (and so one pool of keep-alive connections) per
+# thread and protocol
+def threadSession(protocol, retry, poolSize):
+    session = getattr(sessions, protocol, None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(max_retries=requests.adapters.DEFAULT_RETRIES if retry is None else retry,
+                                                pool_connections=poolSize or requests.adapters.DEFAULT_POOLSIZE,
+                                                pool_maxsize=poolSize or requests.adapters.DEFAULT_POOLSIZE)
+        session.mount("{}://".format(protocol), adapter)
+        setattr(sessions, protocol, session)
+    return session
+
+
+# getresponse() for GETs through cache: ask only for what changed since
+# the cached response, and give that back for a 304
+class Cached:
+
+    def getresponse(self):
+        if cache is None or self.verb != "GET":
+            return super().getresponse()
+        key = cache.key("{}://{}:{}{}".format(self.protocol, self.host, self.port, self.url), self.headers)
+        entry = cache.get(key)
+        if entry is not None:
+            self.headers = dict(self.headers, **cache.conditions(entry))
+        response = super().getresponse()
+        if entry is not None and response.status == 304:
+            return cache.notModified(key, entry, response.headers)
+        cache.put(key, response.status, response.headers, response.text)
+        return response
+
+
+# getresponse() when scheduler says, on the token it says, again if a
+# rate limit refused it
+class Scheduled:
+
+    def getresponse(self):
+        if scheduler is None:
+            return super().getresponse()
+        resource = ghlimit.resource(self.url)
+        attempt = 0
+        while True:
+            budget = scheduler.acquire(resource)
+            if "Authorization" in self.headers:
+                self.headers = dict(self.headers, Authorization="token " + budget.token)
+            response = super().getresponse()
+            if not scheduler.update(budget, response.status, response.headers, response.text, attempt):
+                return response
+            attempt += 1
+
+
+# PyGithub's connection classes, but made for each request (setup()
+# turns off reusing them) on the calling thread's session.  request()
+# is PyGithub's, and so is getresponse() past the cache and scheduler.
+# The cache comes first, so it keys on the token PyGithub was given
+# whichever token the request goes out on.
+class HttpsConnection(Cached, Scheduled, Requester.HTTPSRequestsConnectionClass):
+
+    def __init__(self, host, port=None, strict=False, timeout=None, retry=None, pool_size=None, **kwargs):
+        self.host = host
+        self.port = port if port else 443
+        self.protocol = "https"
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = threadSession(self.protocol, retry, pool_size)
+
+
+class HttpConnection(Cached, Scheduled, Requester.HTTPRequestsConnectionClass):
+
+    def __init__(self, host, port=None, strict=False, timeout=None, retry=None, pool_size=None, **kwargs):
+        self.host = host
+        self.port = port if port else 80
+        self.protocol = "http"
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = threadSession(self.protocol, retry, pool_size)
+
+
+# make PyGithub safe to use from many threads, with at most jobs
+# requests in flight at once, responses from responseCache and requests
+# paced by requestScheduler (None for either for none).  Every request
+# goes through requestJsonAndCheck, so that is where the limit goes.
+def setup(jobs, responseCache=None, requestScheduler=None):
+    global cache, scheduler
+    cache = responseCache
+    scheduler = requestScheduler
+    Requester.Requester.injectConnectionClasses(HttpConnection, HttpsConnection)
+    slots = threading.BoundedSemaphore(max(1, jobs))
+    original = Requester.Requester.requestJsonAndCheck
+
+    def limited(*args, **kwargs):
+        with slots:
+            return original(*args, **kwargs)
+    Requester.Requester.requestJsonAndCheck = limited
+
+
+class Fetcher:
+
+    # with jobs <= 1 everything runs right away on the calling thread,
+    # which is just the old one request at a time
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.pool = None
+        self.leaves = None
+        if jobs > 1:
+            self.pool = ThreadPoolExecutor(max_workers=jobs)
+            # work in pool may wait on leaves, so leaves get their own
+            # threads or the pool could fill up with jobs waiting on work
+            # that can't start
+            self.leaves = ThreadPoolExecutor(max_workers=jobs)
+
+    @staticmethod
+    def now(fn, args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # run fn(*args), which may itself wait on leaf() futures
+    def submit(self, fn, *args):
+        if self.pool is None:
+            return Fetcher.now(fn, args)
+        return self.pool.submit(fn, *args)
+
+    # run fn(*args), which must not wait on other futures
+    def leaf(self, fn, *args):
+        if self.leaves is None:
+            return Fetcher.now(fn, args)
+        return self.leaves.submit(fn, *args)
+
+    # fn(item) for each of items as leaves, results in the order of items
+    def map(self, fn, items):
+        return [future.result() for future in [self.leaf(fn, item) for item in items]]
+
+    def close(self):
+        for pool in (self.pool, self.leaves):
+            if pool is not None:
+                pool.shutdown(wait=True)
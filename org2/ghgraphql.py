@@ -0,0 +1,200 @@
+# GraphQL backend for the org2 scripts.  Over REST every PR costs a
+# request for its details, one each for review comments, issue
+# comments and commits, and then one per commit for its files.  Here a
+# repo's PRs come with their comments, reviews and commits in a few
+# paginated queries (20 PRs a page), and connections that don't fit in
+# the first 100 are paged in separately.
+#
+# What comes back looks enough like PyGithub's objects (the attributes
+# the scripts read) that the same report code works for both.  The one
+# thing GraphQL doesn't have is the files of a commit, so Commit.files
+# still asks REST, only for the commits that are shown.
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+User = namedtuple("User", ["login", "name"])
+Comment = namedtuple("Comment", ["user", "created_at", "body"])
+GitActor = namedtuple("GitActor", ["name", "date"])
+GitCommit = namedtuple("GitCommit", ["author", "message"])
+Head = namedtuple("Head", ["label", "ref"])
+
+# GraphQL refuses fragments a query doesn't use, so queries get only
+# theirs, by withFragments()
+FRAGMENTS = {
+    "Who": "fragment Who on Actor { login ... on User { name } }",
+    "CommentFields": "fragment CommentFields on Comment { author { ...Who } createdAt body }",
+    "CommitFields": "fragment CommitFields on Commit { oid message authoredDate author { name user { login } } }",
+    "ReviewFields": """fragment ReviewFields on PullRequestReview {
+  id
+  comments(first: 100) { pageInfo { hasNextPage endCursor } nodes { ...CommentFields } }
+}""",
+    "BriefPull": """fragment BriefPull on PullRequest {
+  id number title state url createdAt updatedAt mergeStateStatus additions deletions
+  headRefName headRepositoryOwner { login }
+  author { ...Who }
+}""",
+    "FullPull": """fragment FullPull on PullRequest {
+  ...BriefPull
+  comments(first: 100) { totalCount pageInfo { hasNextPage endCursor } nodes { ...CommentFields } }
+  reviews(first: 100) { pageInfo { hasNextPage endCursor } nodes { ...ReviewFields } }
+  commits(first: 100) { totalCount pageInfo { hasNextPage endCursor } nodes { commit { ...CommitFields } } }
+}""",
+}
+
+# a page of PRs, most recently updated first, with BriefPull or FullPull
+PULLS = """query RepoPulls($owner: String!, $name: String!, $states: [PullRequestState!], $after: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: 20, after: $after, states: $states, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...%s }
+    }
+  }
+}"""
+
+# the rest of a connection of a PR or review, by (type, field): what
+# each node is
+MORE = {
+    ("PullRequest", "comments"): "...CommentFields",
+    ("PullRequest", "reviews"): "...ReviewFields",
+    ("PullRequest", "commits"): "commit { ...CommitFields }",
+    ("PullRequestReview", "comments"): "...CommentFields",
+}
+MOREQUERY = """query More($id: ID!, $after: String) {
+  node(id: $id) {
+    ... on %s { %s(first: 100, after: $after) { pageInfo { hasNextPage endCursor } nodes { %s } } }
+  }
+}"""
+
+
+# query followed by the fragments it uses, and the ones they use
+def withFragments(query):
+    used = []
+    todo = [query]
+    while len(todo) > 0:
+        for name in re.findall(r"\.\.\.(\w+)", todo.pop()):
+            if name not in used:
+                used.append(name)
+                todo.append(FRAGMENTS[name])
+    return "\n".join([query] + [FRAGMENTS[name] for name in used])
+
+
+# GitHub's timestamps as the naive UTC datetimes PyGithub gives
+def when(stamp):
+    return datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%SZ")
+
+
+def who(actor):
+    if actor is None:
+        # deleted accounts
+        return User("ghost", None)
+    return User(actor["login"], actor.get("name"))
+
+
+class Commit:
+
+    def __init__(self, repo, node):
+        self.repo = repo
+        self.sha = node["oid"]
+        author = node["author"]
+        self.author = None if author.get("user") is None else User(author["user"]["login"], None)
+        self.commit = GitCommit(GitActor(author["name"], when(node["authoredDate"])), node["message"])
+
+    # not in GraphQL, so one REST request
+    @property
+    def files(self):
+        return self.repo.get_commit(self.sha).files
+
+
+class PullRequest:
+
+    # without comments etc. (a BriefPull), the get_ calls give nothing
+    def __init__(self, repo, node, comments=(), reviewComments=(), commits=()):
+        self.number = node["number"]
+        self.title = node["title"]
+        # REST only has open and closed
+        self.state = "open" if node["state"] == "OPEN" else "closed"
+        self.html_url = node["url"]
+        self.created_at = when(node["createdAt"])
+        self.updated_at = when(node["updatedAt"])
+        self.mergeable_state = node["mergeStateStatus"].lower()
+        self.additions = node["additions"]
+        self.deletions = node["deletions"]
+        owner = node["headRepositoryOwner"]
+        self.head = Head("{}:{}".format("" if owner is None else owner["login"], node["headRefName"]), node["headRefName"])
+        self.user = who(node["author"])
+        self.comments = node["comments"]["totalCount"] if "comments" in node else None
+        self.commits = node["commits"]["totalCount"] if "commits" in node else None
+        self.issueComments = [Comment(who(x["author"]), when(x["createdAt"]), x["body"]) for x in comments]
+        self.reviewComments = sorted((Comment(who(x["author"]), when(x["createdAt"]), x["body"]) for x in reviewComments),
+                                     key=lambda comment: comment.created_at)
+        self.commitList = [Commit(repo, x["commit"]) for x in commits]
+
+    # the same calls as PyGithub's PullRequest, already answered
+    def get_comments(self):
+        return self.reviewComments
+
+    def get_issue_comments(self):
+        return self.issueComments
+
+    def get_commits(self):
+        return self.commitList
+
+
+class Client:
+
+    # gh is the Github object.  Queries go through its requester, so
+    # they get the same authentication (and request limit) as REST.
+    def __init__(self, gh, baseUrl):
+        self.requester = gh._Github__requester
+        # GitHub Enterprise has REST under /api/v3 and GraphQL at
+        # /api/graphql, which has to be given as a whole URL for the
+        # requester not to put /api/v3 in front of it
+        baseUrl = baseUrl.rstrip("/")
+        self.url = baseUrl[:-len("/v3")] + "/graphql" if baseUrl.endswith("/api/v3") else "/graphql"
+
+    def query(self, query, operation, variables):
+        (headers, data) = self.requester.requestJsonAndCheck("POST", self.url, input={"query": query, "operationName": operation,
+                                                                                      "variables": variables})
+        if data.get("errors"):
+            raise RuntimeError("GraphQL {} failed: {}".format(operation, "; ".join(error["message"] for error in data["errors"])))
+        return data["data"]
+
+    # every node of connection (from the first query), getting what
+    # didn't fit in the first page of it from the node with id
+    def all(self, connection, nodeId, typeName, field):
+        nodes = list(connection["nodes"])
+        page = connection["pageInfo"]
+        while page["hasNextPage"]:
+            query = withFragments(MOREQUERY % (typeName, field, MORE[(typeName, field)]))
+            more = self.query(query, "More", {"id": nodeId, "after": page["endCursor"]})["node"][field]
+            nodes.extend(more["nodes"])
+            page = more["pageInfo"]
+        return nodes
+
+    # PullRequests of repo (a PyGithub Repository) in states (e.g.,
+    # ["OPEN"], None for all) updated at or after since, most recently
+    # updated first.  Only with full do they have their comments,
+    # reviews and commits.
+    def pulls(self, repo, states, since, full=True):
+        (owner, name) = repo.full_name.split("/", 1)
+        pulls = []
+        after = None
+        while True:
+            found = self.query(withFragments(PULLS % ("FullPull" if full else "BriefPull")), "RepoPulls", {"owner": owner, "name": name, "states": states, "after": after})
+            connection = found["repository"]["pullRequests"]
+            for node in connection["nodes"]:
+                if when(node["updatedAt"]) < since:
+                    return pulls
+                if not full:
+                    pulls.append(PullRequest(repo, node))
+                    continue
+                reviewComments = []
+                for review in self.all(node["reviews"], node["id"], "PullRequest", "reviews"):
+                    reviewComments.extend(self.all(review["comments"], review["id"], "PullRequestReview", "comments"))
+                pulls.append(PullRequest(repo, node, self.all(node["comments"], node["id"], "PullRequest", "comments"), reviewComments,
+                                         self.all(node["commits"], node["id"], "PullRequest", "commits")))
+            if not connection["pageInfo"]["hasNextPage"]:
+                return pulls
+            after = connection["pageInfo"]["endCursor"]
@@ -0,0 +1,147 @@
+# Keeping the org2 scripts' GitHub API requests inside the rate limits.
+# Each token gets 5000 requests an hour (GraphQL and search have their
+# own limits), and every response says how many are left and when they
+# come back (X-RateLimit-Remaining and -Reset).  Without looking at
+# those, a big org uses up the hour and then every request fails.
+#
+# Each token's budget for each limit goes out as fast as it's asked
+# for until only --reserve of it is left.  The reserve is a token
+# bucket of --burst requests that refills no faster than what's left
+# would last until the reset, so a big run slows down rather than
+# running out.  A request goes out on whichever token has the most in
+# its bucket, so several tokens (GITHUBPAT=token1,token2,...) share
+# the load.  When a response says a limit was hit anyway:
+#
+#  - the token's limit ran out: its budget is empty until the reset and
+#    the request is made again, on another token if there is one
+#  - a secondary limit (too much at once): the token waits the
+#    Retry-After it was given, or a minute doubling each time, plus up
+#    to a quarter more so the threads don't all come back together
+#
+# after --retries of those the response goes to PyGithub as it was.
+# ghfetch's connections call acquire() before each request and
+# update() after.
+
+import random
+import threading
+import time
+import urllib.parse
+import instrument
+
+
+def addArguments(parser):
+    parser.add_argument("--reserve", type=int, default=1000, help="requests left per token below which they are paced to last until the rate limit resets")
+    parser.add_argument("--burst", type=int, default=10, help="requests per token that may go out at once once they are paced")
+    parser.add_argument("--retries", type=int, default=5, help="times to retry a request refused by a rate limit")
+
+
+def fromArguments(args, tokens):
+    return Scheduler(tokens, args.reserve, args.burst, args.retries)
+
+
+# the rate limit a request to url counts against
+def resource(url):
+    path = urllib.parse.urlparse(url).path
+    if path.endswith("/graphql"):
+        return "graphql"
+    if path.startswith("/search/") or "/api/v3/search/" in path:
+        return "search"
+    return "core"
+
+
+# one token's budget for one rate limit
+class Budget:
+
+    def __init__(self, token, reserve, burst):
+        self.token = token
+        self.reserve = reserve
+        self.burst = burst
+        self.level = burst
+        # None until a response tells us
+        self.remaining = None
+        self.reset = 0
+        self.refilled = time.time()
+        self.pausedUntil = 0
+
+    # what's left of the limit per second until it resets
+    def rate(self, now):
+        return self.remaining / max(self.reset - now, 1)
+
+    def refill(self, now):
+        if self.remaining is not None and now >= self.reset:
+            # a new window, which we know nothing about yet
+            self.remaining = None
+        if self.remaining is None or self.remaining > self.reserve:
+            self.level = self.burst
+        else:
+            self.level = min(self.burst, self.remaining, self.level + (now - self.refilled) * self.rate(now))
+        self.refilled = now
+
+    # seconds until a request can go out on this budget
+    def wait(self, now):
+        if now < self.pausedUntil:
+            return self.pausedUntil - now
+        if self.remaining == 0:
+            return self.reset - now + 1
+        if self.level >= 1:
+            return 0
+        return (1 - self.level) / self.rate(now)
+
+
+class Scheduler:
+
+    def __init__(self, tokens, reserve, burst, retries):
+        self.tokens = tokens
+        self.reserve = max(0, reserve)
+        self.burst = max(1, burst)
+        self.retries = retries
+        self.budgets = {}
+        self.changed = threading.Condition()
+
+    # the Budget to make a request to resource on, once there is one
+    def acquire(self, resource):
+        with self.changed:
+            while True:
+                now = time.time()
+                budgets = [self.budgets.setdefault((token, resource), Budget(token, self.reserve, self.burst)) for token in self.tokens]
+                for budget in budgets:
+                    budget.refill(now)
+                ready = [budget for budget in budgets if budget.wait(now) <= 0]
+                if len(ready) > 0:
+                    budget = max(ready, key=lambda budget: budget.level)
+                    budget.level -= 1
+                    if budget.remaining is not None:
+                        budget.remaining -= 1
+                    return budget
+                wait = min(budget.wait(now) for budget in budgets)
+                instrument.count("rate limit waits")
+                self.changed.wait(wait)
+
+    # note what the response to a request made on budget says about the
+    # limits, and whether to make the request again (attempt is how many
+    # times it has already been retried)
+    def update(self, budget, status, headers, text, attempt):
+        with self.changed:
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset = headers.get("X-RateLimit-Reset")
+            if remaining is not None and reset is not None and int(reset) >= budget.reset:
+                budget.reset = int(reset)
+                budget.remaining = int(remaining)
+                budget.level = min(budget.level, budget.remaining)
+            if status not in (403, 429) or attempt >= self.retries:
+                return False
+            retryAfter = headers.get("Retry-After")
+            if retryAfter is not None:
+                wait = int(retryAfter)
+            elif budget.remaining == 0:
+                # acquire() waits for the reset, or takes another token
+                instrument.count("rate limited")
+                return True
+            elif "secondary rate limit" in text.lower():
+                wait = min(60 * 2 ** attempt, 900)
+            else:
+                # refused for some other reason
+                return False
+            instrument.count("secondary rate limited")
+            budget.pausedUntil = max(budget.pausedUntil, time.time() + wait * random.uniform(1, 1.25))
+            return True
@@ -0,0 +1,462 @@
+#!/home/seth/.virtualenvs/gitutils/bin/python
+
+# A local stand-in for the parts of the GitHub API the org2 scripts
+# use, to try them (and their -j/--jobs) without a token, a real org or
+# the rate limit:
+#
+#   ./mockgithub.py --port 8765 --repos 200 --latency 0.05 &
+#   GITHUBPAT=x ./changes-since.py --api-url http://127.0.0.1:8765 -o mock -d
+#
+# The data is made up but always the same for the same options, so two
+# runs with different settings can be diffed.  Dates are relative to
+# when the server started, most of them within the last day.
+# GET /_mock/stats gives the number of requests served, how many of
+# them were answered 304 Not Modified (every 200 to a GET has an ETag,
+# as on GitHub), and the most that were in flight at once.
+#
+# Like GitHub, each token (and GraphQL separately) may make
+# --rate-limit requests, not counting 304s, until the window that
+# starts with its first request ends, and is refused with a 403 after
+# that.  --secondary refuses that fraction of requests with the 403 of
+# a secondary rate limit and a Retry-After.  The stats count both, and
+# the requests made with each token (by its last four characters).
+#
+# POST /graphql answers the queries of ghgraphql.py (-g/--graphql) from
+# the same data, so the REST and GraphQL reports can be diffed, with
+# --graphql-page making nested connections short enough to be paged.
+#
+# It can also stand in for the real API with recorded responses:
+# --record FILE passes every request on to --upstream and keeps what
+# comes back, and --replay FILE answers from that alone.
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser(description="serve a fake GitHub org for testing the org2 scripts",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-p", "--port", type=int, default=8765, help="port to listen on (localhost only)")
+parser.add_argument("-o", "--org", default="mock", help="name of the organization")
+parser.add_argument("-r", "--repos", type=int, default=20, help="number of repos")
+parser.add_argument("--prs", type=int, default=5, help="pull requests per repo")
+parser.add_argument("--comments", type=int, default=3, help="comments of each kind per pull request")
+parser.add_argument("--commits", type=int, default=4, help="commits per pull request (and per repo since the date)")
+parser.add_argument("--files", type=int, default=3, help="files per commit")
+parser.add_argument("-l", "--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+parser.add_argument("-s", "--seed", type=int, default=1, help="random seed for the data")
+parser.add_argument("--rate-limit", type=int, default=5000, help="requests each token may make in a rate limit window")
+parser.add_argument("--rate-window", type=int, default=3600, help="seconds from a token's first request until its rate limit resets")
+parser.add_argument("--secondary", type=float, default=0.0, help="fraction of requests to refuse with a secondary rate limit")
+parser.add_argument("--retry-after", type=int, default=1, help="seconds to tell requests refused by --secondary to wait")
+parser.add_argument("--graphql-page", type=int, default=100, help="most nodes in a page of a GraphQL connection in a PR")
+parser.add_argument("--record", metavar="FILE", help="pass requests on to --upstream and append what it answers to FILE")
+parser.add_argument("--upstream", default="https://api.github.com", help="the API --record passes requests on to")
+parser.add_argument("--replay", metavar="FILE", help="answer only with the responses recorded in FILE")
+args = parser.parse_args()
+
+PEOPLE = ["seth4618", "gxlin2", "kimjanise", "Adrastopoulos"]
+NAMES = {"seth4618": "Seth", "gxlin2": "Grace", "kimjanise": "Janise", "Adrastopoulos": "Gabriel Hall"}
+started = datetime.now(timezone.utc).replace(microsecond=0)
+base = "http://127.0.0.1:{}".format(args.port)
+stats = {"requests": 0, "inflight": 0, "peak": 0, "notModified": 0, "rateLimited": 0, "secondary": 0, "tokens": {}}
+lock = threading.Lock()
+# (token, "core" or "graphql") -> [reset, requests made]
+windows = {}
+refusals = random.Random(args.seed)
+
+
+def stamp(minutesAgo):
+    return (started - timedelta(minutes=minutesAgo)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def user(login):
+    return {"login": login, "id": PEOPLE.index(login) + 1, "type": "User", "url": "{}/users/{}".format(base, login)}
+
+
+################################################################
+# the org, made up front so every request sees the same thing
+
+def makeOrg():
+    rand = random.Random(args.seed)
+    repos = []
+    for r in range(args.repos):
+        name = "repo{}".format(r)
+        url = "{}/repos/{}/{}".format(base, args.org, name)
+        repo = {"id": r + 1, "name": name, "full_name": "{}/{}".format(args.org, name), "url": url,
+                "html_url": "https://github.com/{}/{}".format(args.org, name), "private": True}
+        commits = {}
+
+        def commit(minutesAgo):
+            sha = "{:040x}".format(rand.getrandbits(160))
+            login = rand.choice(PEOPLE)
+            files = [{"filename": "src/file{}.py".format(rand.randrange(50)), "additions": rand.randrange(100),
+                      "deletions": rand.randrange(50), "status": "modified"} for f in range(args.files)]
+            short = {"sha": sha, "url": "{}/commits/{}".format(url, sha), "author": user(login),
+                     "commit": {"author": {"name": NAMES[login], "date": stamp(minutesAgo)},
+                                "message": "change {}\n\nmore about it".format(sha[:7])}}
+            commits[sha] = dict(short, files=files)
+            return short
+
+        pulls = []
+        for n in range(1, args.prs + 1):
+            purl = "{}/pulls/{}".format(url, n)
+            issueUrl = "{}/issues/{}".format(url, n)
+            login = rand.choice(PEOPLE)
+            updated = rand.randrange(60 * 48)
+            # every fourth one closed, so -c and -a have something to show
+            state = "closed" if n % 4 == 0 else "open"
+            pull = {"id": r * 1000 + n, "number": n, "title": "PR {} of {}".format(n, name), "state": state,
+                    "url": purl, "issue_url": issueUrl, "html_url": "https://github.com/{}/{}/pull/{}".format(args.org, name, n),
+                    "updated_at": stamp(updated), "created_at": stamp(updated + 600), "user": user(login),
+                    "head": {"label": "{}:branch{}".format(args.org, n), "ref": "branch{}".format(n), "sha": "{:040x}".format(n)},
+                    "base": {"label": "{}:main".format(args.org), "ref": "main", "sha": "{:040x}".format(0)}}
+            full = dict(pull, mergeable_state=rand.choice(["clean", "dirty", "blocked"]), comments=args.comments,
+                        commits=args.commits, additions=rand.randrange(500), deletions=rand.randrange(200))
+
+            # oldest first, like GitHub
+            def comments(kind):
+                return sorted([{"id": rand.getrandbits(31), "user": user(rand.choice(PEOPLE)), "created_at": stamp(rand.randrange(updated, updated + 600)),
+                                "body": "{} comment {}\nsecond line".format(kind, c), "url": "{}/{}/{}".format(url, kind, c)}
+                               for c in range(args.comments)], key=lambda c: c["created_at"])
+            pulls.append({"pull": pull, "full": full, "reviews": comments("review"), "comments": comments("issue"),
+                          "commits": [commit(rand.randrange(updated, updated + 600)) for c in range(args.commits)],
+                          "issue": {"id": r * 1000 + n, "number": n, "title": "Issue for PR {} of {}".format(n, name), "url": issueUrl,
+                                    "html_url": "https://github.com/{}/{}/issues/{}".format(args.org, name, n), "state": state,
+                                    "updated_at": stamp(updated), "repository": repo, "user": user(login),
+                                    "assignees": [user(rand.choice(PEOPLE))], "labels_url": issueUrl + "/labels{/name}"},
+                          "labels": [{"name": rand.choice(["bug", "feature", "chore"]), "url": issueUrl + "/labels/x"}]})
+        recent = [commit(rand.randrange(60 * 48)) for c in range(args.commits)]
+        repos.append({"repo": repo, "pulls": pulls, "recent": recent, "commits": commits})
+    return repos
+
+
+repos = makeOrg()
+byName = {entry["repo"]["name"]: entry for entry in repos}
+
+
+################################################################
+# GraphQL.  There is no parser here, just the two queries ghgraphql.py
+# makes, told apart by operationName.
+
+def actor(login):
+    return {"login": login, "name": NAMES[login]}
+
+
+def comment(c):
+    return {"author": actor(c["user"]["login"]), "createdAt": c["created_at"], "body": c["body"]}
+
+
+def gitCommit(c):
+    return {"oid": c["sha"], "message": c["commit"]["message"], "authoredDate": c["commit"]["author"]["date"],
+            "author": {"name": c["commit"]["author"]["name"], "user": {"login": c["author"]["login"]}}}
+
+
+# a page of items; cursors are just offsets
+def connection(items, first, after, total=False):
+    start = 0 if after is None else int(after)
+    nodes = items[start:start + first]
+    found = {"pageInfo": {"hasNextPage": start + len(nodes) < len(items), "endCursor": str(start + len(nodes))}, "nodes": nodes}
+    if total:
+        found["totalCount"] = len(items)
+    return found
+
+
+# review comments two to a review
+def reviews(entry, pull):
+    found = []
+    for (r, start) in enumerate(range(0, len(pull["reviews"]), 2)):
+        found.append({"id": "PRR:{}:{}:{}".format(entry["repo"]["name"], pull["pull"]["number"], r),
+                      "comments": [comment(c) for c in pull["reviews"][start:start + 2]]})
+    return found
+
+
+# connection field of the PR or review, as the first page or after a cursor
+def nested(entry, pull, field, after=None):
+    first = min(100, args.graphql_page)
+    if field == "comments":
+        return connection([comment(c) for c in pull["comments"]], first, after, total=True)
+    if field == "commits":
+        return connection([{"commit": gitCommit(c)} for c in pull["commits"]], first, after, total=True)
+    found = connection(reviews(entry, pull), first, after)
+    found["nodes"] = [dict(review, comments=connection(review["comments"], first, None)) for review in found["nodes"]]
+    return found
+
+
+def pullNode(entry, pull, full):
+    data = pull["full"]
+    node = {"id": "PR:{}:{}".format(entry["repo"]["name"], data["number"]), "number": data["number"], "title": data["title"],
+            "state": data["state"].upper(), "url": data["html_url"], "createdAt": data["created_at"],
+            "updatedAt": data["updated_at"], "mergeStateStatus": data["mergeable_state"].upper(), "additions": data["additions"],
+            "deletions": data["deletions"], "headRefName": data["head"]["ref"], "headRepositoryOwner": {"login": args.org},
+            "author": actor(data["user"]["login"])}
+    if full:
+        for field in ("comments", "reviews", "commits"):
+            node[field] = nested(entry, pull, field)
+    return node
+
+
+def graphql(request):
+    variables = request.get("variables") or {}
+    operation = request.get("operationName")
+    if operation == "RepoPulls":
+        entry = byName.get(variables["name"])
+        if variables["owner"] != args.org or entry is None:
+            return {"data": {"repository": None}, "errors": [{"message": "Could not resolve to a Repository"}]}
+        pulls = [pull for pull in sorted(entry["pulls"], key=lambda pull: pull["pull"]["updated_at"], reverse=True)
+                 if variables.get("states") is None or pull["full"]["state"].upper() in variables["states"]]
+        first = int(re.search(r"pullRequests\(first: (\d+)", request["query"]).group(1))
+        page = connection(pulls, first, variables.get("after"))
+        page["nodes"] = [pullNode(entry, pull, "...FullPull" in request["query"]) for pull in page["nodes"]]
+        return {"data": {"repository": {"pullRequests": page}}}
+    if operation == "More":
+        (typeName, field) = re.search(r"\.\.\. on (\w+) \{ (\w+)\(", request["query"]).groups()
+        ids = variables["id"].split(":")
+        entry = byName.get(ids[1])
+        pull = entry["pulls"][int(ids[2]) - 1]
+        if typeName == "PullRequest":
+            return {"data": {"node": {field: nested(entry, pull, field, variables.get("after"))}}}
+        review = reviews(entry, pull)[int(ids[3])]
+        return {"data": {"node": {field: connection(review["comments"], min(100, args.graphql_page), variables.get("after"))}}}
+    return {"errors": [{"message": "Unknown operation {}".format(operation)}]}
+
+
+################################################################
+# recording and replaying
+
+recorded = {}
+if args.replay is not None:
+    with open(args.replay) as f:
+        for line in f:
+            entry = json.loads(line)
+            recorded[(entry["method"], entry["path"], entry["body"])] = entry
+
+
+# a request body as its recording key: GraphQL requests are JSON, which
+# could come with the keys in any order
+def bodyKey(body):
+    if body is None or len(body) == 0:
+        return None
+    try:
+        return json.dumps(json.loads(body), sort_keys=True)
+    except ValueError:
+        return body.decode(errors="replace")
+
+
+################################################################
+# rate limits
+
+# (remaining, reset) of the rate limit key, after counting a request
+# if count
+def rateLimit(key, count):
+    with lock:
+        now = time.time()
+        window = windows.get(key)
+        if window is None or now >= window[0]:
+            window = windows[key] = [int(now) + args.rate_window, 0]
+        if count:
+            window[1] += 1
+        return (max(0, args.rate_limit - window[1]), window[0])
+
+
+################################################################
+# serving
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def limitKey(self):
+        return (self.headers.get("Authorization", ""), "graphql" if urllib.parse.urlparse(self.path).path == "/graphql" else "core")
+
+    def limitHeaders(self, count):
+        (remaining, reset) = rateLimit(self.limitKey(), count)
+        self.send_header("X-RateLimit-Limit", str(args.rate_limit))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(reset))
+        self.send_header("X-RateLimit-Resource", self.limitKey()[1])
+
+    # answer as GitHub does if a rate limit refuses the request, and
+    # say whether one did
+    def refused(self):
+        if rateLimit(self.limitKey(), False)[0] == 0:
+            with lock:
+                stats["rateLimited"] += 1
+            self.send({"message": "API rate limit exceeded.", "documentation_url": "https://docs.github.com/rest/rate-limit"},
+                      status=403, counted=False)
+            return True
+        if args.secondary > 0:
+            with lock:
+                refuse = refusals.random() < args.secondary
+                if refuse:
+                    stats["secondary"] += 1
+            if refuse:
+                self.send({"message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again.",
+                           "documentation_url": "https://docs.github.com/rest/rate-limit"}, status=403, counted=False,
+                          retryAfter=args.retry_after)
+                return True
+        return False
+
+    def send(self, data, status=200, link=None, raw=None, counted=True, retryAfter=None):
+        body = json.dumps(data).encode() if raw is None else raw
+        etag = None
+        if status == 200 and self.command == "GET":
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                with lock:
+                    stats["notModified"] += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.limitHeaders(False)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.limitHeaders(counted)
+        if retryAfter is not None:
+            self.send_header("Retry-After", str(retryAfter))
+        if link is not None:
+            self.send_header("Link", link)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # send one page of items like GitHub does, with a Link to the next
+    def page(self, path, query, items):
+        perPage = int(query.get("per_page", ["30"])[0])
+        number = int(query.get("page", ["1"])[0])
+        link = None
+        if number * perPage < len(items):
+            rest = dict((key, values[0]) for (key, values) in query.items())
+            rest.update(page=number + 1, per_page=perPage)
+            link = '<{}{}?{}>; rel="next"'.format(base, path, urllib.parse.urlencode(rest))
+        self.send(items[(number - 1) * perPage:number * perPage], link=link)
+
+    def do_GET(self):
+        self.serve(None)
+
+    def do_POST(self):
+        self.serve(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def serve(self, body):
+        with lock:
+            stats["requests"] += 1
+            stats["inflight"] += 1
+            stats["peak"] = max(stats["peak"], stats["inflight"])
+        try:
+            if args.latency > 0:
+                time.sleep(args.latency)
+            if self.path == "/_mock/stats":
+                self.answer()
+                return
+            with lock:
+                token = self.headers.get("Authorization", "")[-4:]
+                stats["tokens"][token] = stats["tokens"].get(token, 0) + 1
+            if self.refused():
+                pass
+            elif args.record is not None:
+                self.record(body)
+            elif args.replay is not None:
+                self.replay(body)
+            elif self.command == "POST" and urllib.parse.urlparse(self.path).path == "/graphql":
+                self.send(graphql(json.loads(body)))
+            else:
+                self.answer()
+        finally:
+            with lock:
+                stats["inflight"] -= 1
+
+    # pass the request on to the real API and keep what it says, with
+    # its links pointing back here
+    def record(self, body):
+        headers = dict((name, self.headers[name]) for name in ("Authorization", "Accept", "Content-Type") if name in self.headers)
+        request = urllib.request.Request(args.upstream.rstrip("/") + self.path, data=body, headers=headers, method=self.command)
+        try:
+            with urllib.request.urlopen(request) as response:
+                (status, link, raw) = (response.status, response.headers.get("Link"), response.read())
+        except urllib.error.HTTPError as e:
+            (status, link, raw) = (e.code, e.headers.get("Link"), e.read())
+        if link is not None:
+            link = link.replace(args.upstream.rstrip("/"), base)
+        entry = {"method": self.command, "path": self.path, "body": bodyKey(body), "status": status, "link": link,
+                 "response": raw.decode()}
+        with lock:
+            with open(args.record, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self.send(None, status=status, link=link, raw=raw)
+
+    def replay(self, body):
+        entry = recorded.get((self.command, self.path, bodyKey(body)))
+        if entry is None:
+            return self.send({"message": "Not recorded: {} {}".format(self.command, self.path)}, status=404)
+        self.send(None, status=entry["status"], link=entry["link"], raw=entry["response"].encode())
+
+    def answer(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts == ["_mock", "stats"]:
+            with lock:
+                found = json.loads(json.dumps(stats))
+            return self.send(found, counted=False)
+        if len(parts) == 2 and parts[0] == "users" and parts[1] in NAMES:
+            return self.send(dict(user(parts[1]), name=NAMES[parts[1]]))
+        if len(parts) >= 2 and parts[0] == "orgs" and parts[1] == args.org:
+            if len(parts) == 2:
+                return self.send({"login": args.org, "id": 1, "url": "{}/orgs/{}".format(base, args.org)})
+            if parts[2:] == ["repos"]:
+                return self.page(url.path, query, [entry["repo"] for entry in repos])
+            if parts[2:] == ["issues"]:
+                return self.page(url.path, query, [pull["issue"] for entry in repos for pull in entry["pulls"]])
+        if len(parts) >= 4 and parts[0] == "repos" and parts[1] == args.org and parts[2] in byName:
+            entry = byName[parts[2]]
+            rest = parts[3:]
+            if rest == ["pulls"]:
+                state = query.get("state", ["open"])[0]
+                pulls = sorted((pull for pull in entry["pulls"] if state == "all" or pull["pull"]["state"] == state),
+                               key=lambda pull: pull["pull"]["updated_at"], reverse=True)
+                return self.page(url.path, query, [pull["pull"] for pull in pulls])
+            if rest == ["commits"]:
+                return self.page(url.path, query, entry["recent"])
+            if len(rest) == 2 and rest[0] == "commits" and rest[1] in entry["commits"]:
+                return self.send(entry["commits"][rest[1]])
+            if len(rest) >= 2 and rest[0] in ("pulls", "issues") and rest[1].isdigit() and 1 <= int(rest[1]) <= len(entry["pulls"]):
+                pull = entry["pulls"][int(rest[1]) - 1]
+                if rest[0] == "pulls" and len(rest) == 2:
+                    return self.send(pull["full"])
+                if rest[0] == "pulls" and rest[2:] == ["comments"]:
+                    return self.page(url.path, query, pull["reviews"])
+                if rest[0] == "pulls" and rest[2:] == ["commits"]:
+                    return self.page(url.path, query, pull["commits"])
+                if rest[0] == "issues" and rest[2:] == ["comments"]:
+                    return self.page(url.path, query, pull["comments"])
+                if rest[0] == "issues" and rest[2:] == ["labels"]:
+                    return self.page(url.path, query, pull["labels"])
+        self.send({"message": "Not Found", "documentation_url": "https://docs.github.com/rest"}, status=404)
+
+
+server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+server.daemon_threads = True
+if args.record is not None:
+    print("Recording {} on {} to {}".format(args.upstream, base, args.record))
+elif args.replay is not None:
+    print("Replaying {} responses from {} on {}".format(len(recorded), args.replay, base))
+else:
+    print("Serving {} repos of {} on {}".format(len(repos), args.org, base))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+print("{} requests, at most {} at once".format(stats["requests"], stats["peak"]))
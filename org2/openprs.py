@@ -3,15 +3,25 @@
 # open all PRs in an org on a repo within a time frame
 
 import webbrowser
-from github import Github, NamedUser
+from github import Github, NamedUser, Requester
 import os
 import sys
 from datetime import datetime, timedelta
 import pytz
 from tzlocal import get_localzone 
-import argparser
+import argparse
 
-parser = argparser.ArgumentParser(description="show PRs in web")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import instrument
+import ghfetch
+import ghcache
+import ghlimit
+import ghgraphql
+
+# every API request goes through here
+instrument.countCalls(Requester.Requester, "requestJsonAndCheck", "github api")
+
+parser = argparse.ArgumentParser(description="show PRs in web")
 parser.add_argument('-s', '--since', default="", help='starting date')
 parser.add_argument('-o', '--org', default='monatized', help='organization to show changes on')
 parser.add_argument('-r', '--repo', default=None, help='restrict to this repo only')
@@ -20,7 +30,14 @@ parser.add_argument('-a', '--all', action="store_true", help='report on ALL PRs'
 parser.add_argument('--noweb', action="store_true", help='do not open web page')
 parser.add_argument('-p', '--days', type=int, default=1, help='how many days back to go')
 parser.add_argument('-m', '--minutes', type=int, default=-1, help='how many minutes to go back (-1 to ignore)')
+parser.add_argument('-j', '--jobs', type=int, default=8, help='most API requests in flight at once')
+parser.add_argument('--api-url', default='https://api.github.com', help='GitHub API to use (e.g., a local mock server)')
+parser.add_argument('-g', '--graphql', action="store_true", help='get PRs from the GraphQL API (far fewer requests)')
+ghcache.addArguments(parser)
+ghlimit.addArguments(parser)
+instrument.addArguments(parser)
 args = parser.parse_args()
+instrument.fromArguments(args)
 
 # deal with how far back we go
 since = None
@@ -52,34 +69,56 @@ def getFromEnv(name: str) -> str:
     assert val is not None, "{} must be defined in environment to run this application".format(name)
     return val
 
+# (line, url) for each PR of repo updated since since, newest first.
+# Runs on a fetcher thread.
+def listPRs(repo):
+    if graphql is not None:
+        # merged PRs are closed ones to REST
+        states = {"open": ["OPEN"], "closed": ["CLOSED", "MERGED"], "all": None}[status]
+        return [("PR {}:{:16} {} {:6} {:4} '{}'".format(repo.name, bname(pr.head.label), pr.updated_at, pr.mergeable_state, pr.state,
+                                                       pr.title), pr.html_url)
+                for pr in graphql.pulls(repo, states, since, full=False)]
+    prs = []
+    for pr in repo.get_pulls(state=status, sort="updated", direction="desc"):
+        if pr.updated_at < since:
+            # we are now older than we required, so we can abort
+            break
+        prs.append(pr)
+    # the list doesn't have mergeable_state, each PR is read for it
+    states = fetcher.map(lambda pr: pr.mergeable_state, prs)
+    return [("PR {}:{:16} {} {:6} {:4} '{}'".format(repo.name, bname(pr.head.label), pr.updated_at, state, pr.state, pr.title), pr.html_url)
+            for (pr, state) in zip(prs, states)]
+
 ################################################################
 # main entry
 
-accessToken = getFromEnv('GITHUBPAT')
+# one token, or several separated by commas to share the rate limit
+tokens = getFromEnv('GITHUBPAT').split(',')
 
 # using an access token
-gh = Github(accessToken)
-org = gh.get_organization(orgname)
+cache = ghcache.fromArguments(args)
+ghfetch.setup(args.jobs, cache, ghlimit.fromArguments(args, tokens))
+fetcher = ghfetch.Fetcher(args.jobs)
+gh = Github(tokens[0], base_url=args.api_url, pool_size=args.jobs)
+graphql = ghgraphql.Client(gh, args.api_url) if args.graphql else None
+with instrument.phase("org"):
+    org = gh.get_organization(orgname)
 
 browserOpened = 1
 
-repos = org.get_repos()
-for repo in repos:
-    if reponame is not None and reponame != repo.name:
-        continue
-
-    for pr in repo.get_pulls(state=status, sort="updated", direction="desc"):
-        if pr.updated_at >= since:
-            user = pr.user
-            print("PR {}:{:16} {} {:6} {:4} '{}'".format(repo.name, bname(pr.head.label), pr.updated_at, pr.mergeable_state, pr.state, 
-                                                         pr.title))
+with instrument.phase("repos"):
+    repos = [repo for repo in org.get_repos() if reponame is None or reponame == repo.name]
+    jobs = [fetcher.submit(listPRs, repo) for repo in repos]
+with instrument.phase("pull requests"):
+    for job in jobs:
+        for (line, url) in job.result():
+            print(line)
             # open in new window first time, then in new tab for each other time
             if openweb:
-                webbrowser.open(pr.html_url, new=browserOpened)
+                webbrowser.open(url, new=browserOpened)
                 browserOpened = 2
             else:
-                print(f"   {pr.html_url}")
-        else:
-            # we are now older than we required, so we can abort
-            break
-
+                print(f"   {url}")
+fetcher.close()
+if cache is not None:
+    cache.close()
@@ -0,0 +1,109 @@
+# Patch ids (git patch-id --stable) of commits, kept under .git so
+# comparing long-lived branches again only hashes the new commits.  Two
+# commits with the same patch id make the same change, e.g., a commit
+# and its cherry-pick or rebased copy.
+#
+# The file is a small header followed by fixed size records: raw
+# commit sha and raw patch id, all zero for commits that have no patch
+# (merges, empty commits).  Like the graph cache, records are only
+# appended and the count in the header is written last.
+
+import fcntl
+import os
+import struct
+import gitstream
+import instrument
+
+CACHENAME = "gitutils-patchids"
+NOPATCH = bytes(20)
+
+
+class PatchIds:
+    MAGIC = b"GUPI"
+    VERSION = 1
+    HEADER = struct.Struct("<4sII")
+    RECORD = struct.Struct("<20s20s")
+
+    # gitdir None keeps the ids in memory only
+    def __init__(self, gitdir):
+        self.path = os.path.join(gitdir, CACHENAME) if gitdir is not None else None
+        self.ids = {}
+        self.added = []
+        self.saved = 0
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        self.parse(data)
+
+    # the records counted in the header of data, if it is usable
+    def parse(self, data):
+        if len(data) < PatchIds.HEADER.size:
+            return
+        (magic, version, count) = PatchIds.HEADER.unpack_from(data)
+        end = PatchIds.HEADER.size + count * PatchIds.RECORD.size
+        if magic != PatchIds.MAGIC or version != PatchIds.VERSION or len(data) < end:
+            print("Ignoring unusable patch id cache {}".format(self.path))
+            return
+        for (sha, patchid) in PatchIds.RECORD.iter_unpack(data[PatchIds.HEADER.size:end]):
+            self.ids[sha] = patchid
+        self.saved = count
+
+    # append the ids found since the last load/save and then update the
+    # count, with the file locked.  If another process saved since we
+    # loaded, what it wrote is read first and ours go after it.
+    def save(self):
+        if self.path is None or len(self.added) == 0:
+            return
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            header = f.read(PatchIds.HEADER.size)
+            onDisk = PatchIds.HEADER.unpack(header) if len(header) == PatchIds.HEADER.size else (None, None, 0)
+            if onDisk != (PatchIds.MAGIC, PatchIds.VERSION, self.saved):
+                ours = self.ids
+                self.ids = {}
+                self.saved = 0
+                f.seek(0)
+                self.parse(f.read())
+                self.added = [sha for sha in self.added if sha not in self.ids]
+                for (sha, patchid) in ours.items():
+                    self.ids.setdefault(sha, patchid)
+            count = self.saved + len(self.added)
+            if self.saved == 0:
+                f.seek(0)
+                f.write(PatchIds.HEADER.pack(PatchIds.MAGIC, PatchIds.VERSION, 0))
+            f.seek(PatchIds.HEADER.size + self.saved * PatchIds.RECORD.size)
+            f.truncate()
+            for sha in self.added:
+                f.write(PatchIds.RECORD.pack(sha, self.ids[sha]))
+            f.flush()
+            f.seek(0)
+            f.write(PatchIds.HEADER.pack(PatchIds.MAGIC, PatchIds.VERSION, count))
+        self.saved = count
+        self.added = []
+
+    # {hexsha: patch id} for every one of hexshas that has a patch,
+    # hashing the ones we don't know yet in one go
+    def get(self, repodir, hexshas):
+        hexshas = list(hexshas)
+        todo = list(dict.fromkeys(hexsha for hexsha in hexshas if bytes.fromhex(hexsha) not in self.ids))
+        instrument.hits("patch ids", len(hexshas) - len(todo), len(todo))
+        if len(todo) > 0:
+            for (patchid, hexsha) in gitstream.patchIds(repodir, todo):
+                self.ids[bytes.fromhex(hexsha)] = bytes.fromhex(patchid)
+            for hexsha in todo:
+                sha = bytes.fromhex(hexsha)
+                self.ids.setdefault(sha, NOPATCH)
+                self.added.append(sha)
+        result = {}
+        for hexsha in hexshas:
+            patchid = self.ids[bytes.fromhex(hexsha)]
+            if patchid != NOPATCH:
+                result[hexsha] = patchid.hex()
+        return result
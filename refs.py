@@ -0,0 +1,102 @@
+# Read refs with one `git for-each-ref`, which also gives the commit
+# each one points at and its committer date, so filtering by date
+# doesn't need a commit object per ref.  RefIndex turns the names
+# people type into those refs for bgraph and findcommon.
+
+from collections import namedtuple
+import fnmatch
+import string
+import subprocess
+import gitstream
+import instrument
+
+# name is the short name we show (master, origin/foo, v1.0), hexsha and
+# date are for the commit the ref ends up at (tags are peeled)
+Ref = namedtuple("Ref", ["name", "refname", "hexsha", "date"])
+
+FORMAT = "%00".join(["%(refname)", "%(refname:short)", "%(symref)",
+                     "%(objecttype)", "%(objectname)", "%(committerdate:unix)",
+                     "%(*objecttype)", "%(*objectname)", "%(*committerdate:unix)"])
+
+HEADS = "refs/heads"
+REMOTES = "refs/remotes"
+TAGS = "refs/tags"
+
+
+# yield a Ref for every ref under the given prefixes that ends up at a
+# commit.  Symbolic refs (origin/HEAD) are skipped.
+def readRefs(repodir, prefixes):
+    for line in gitstream.gitLines(repodir, ["for-each-ref", "--format={}".format(FORMAT)] + list(prefixes)):
+        (refname, short, symref, otype, hexsha, date, ptype, phexsha, pdate) = line.split("\0")
+        if symref != "":
+            continue
+        if ptype != "":
+            # annotated tag, use what it points to
+            (otype, hexsha, date) = (ptype, phexsha, pdate)
+        if otype != "commit":
+            continue
+        yield Ref(short, refname, hexsha, int(date))
+
+
+# Every ref read once, for looking names up the way git does
+# (refs/heads/x, heads/x, x, origin/x, v1.0) without going back to git
+# or scanning.  Short names that are ambiguous go to tags, then heads,
+# then remotes, like git rev-parse.  A full sha is looked up in the ref
+# tips and, if given, the commits of a GraphStore.  Everything else is
+# asked of git log: abbreviated shas too, since only git knows whether
+# some other object shares the prefix, and shas outside both and
+# things like HEAD~3.
+class RefIndex:
+    PRECEDENCE = [TAGS, HEADS, REMOTES]
+
+    def __init__(self, repodir, store=None):
+        self.repodir = repodir
+        self.store = store
+        self.refs = list(readRefs(repodir, RefIndex.PRECEDENCE))
+        self.byName = {}
+        for prefix in RefIndex.PRECEDENCE:
+            for ref in self.refs:
+                if ref.refname.startswith(prefix + "/"):
+                    self.byName.setdefault(ref.refname, ref)
+                    self.byName.setdefault(ref.refname[len("refs/"):], ref)
+                    self.byName.setdefault(ref.refname[len(prefix) + 1:], ref)
+        # the dates of ref tips, made on the first sha lookup
+        self.tipDates = None
+
+    # refs under any of prefixes, in for-each-ref order
+    def under(self, prefixes):
+        return [ref for ref in self.refs if any(ref.refname.startswith(prefix + "/") for prefix in prefixes)]
+
+    # refs whose short name matches the glob pattern
+    def match(self, pattern):
+        return [ref for ref in self.refs if fnmatch.fnmatchcase(ref.name, pattern)]
+
+    # the date of the commit with the full sha hexsha if it is a ref tip
+    # or in the store, else None
+    def knownDate(self, hexsha):
+        if self.tipDates is None:
+            self.tipDates = {ref.hexsha: ref.date for ref in self.refs}
+        if hexsha in self.tipDates:
+            return self.tipDates[hexsha]
+        idx = None if self.store is None else self.store.lookup(hexsha)
+        return None if idx is None else self.store.dates[idx]
+
+    # Ref for name, or None if it doesn't name a commit.  Shas and other
+    # revisions get name as their name and no refname.
+    def resolve(self, name):
+        ref = self.byName.get(name)
+        if ref is not None:
+            return ref
+        if len(name) == 40 and all(c in string.hexdigits for c in name):
+            date = self.knownDate(name.lower())
+            if date is not None:
+                return Ref(name, "", name.lower(), date)
+        if name.startswith("-"):
+            return None
+        instrument.count("git log")
+        result = subprocess.run(["git", "-C", self.repodir, "log", "-1", "--no-walk", "--format=%H %ct", name, "--"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if result.returncode != 0 or result.stdout.strip() == "":
+            return None
+        (hexsha, date) = result.stdout.split()
+        return Ref(name, "", hexsha, int(date))
@@ -0,0 +1,37 @@
+# Notice when refs move by polling what git writes when they do: the
+# loose ref files under refs/ and packed-refs.  Updating a ref replaces
+# its file, so a stat of each is enough and no git process is needed.
+# Polling keeps this working everywhere without an inotify package.
+
+import os
+
+
+class RefWatcher:
+
+    def __init__(self, gitdir):
+        self.gitdir = gitdir
+        self.last = self.scan()
+
+    # (path, mtime, size) of every ref file
+    def scan(self):
+        result = []
+        paths = [os.path.join(self.gitdir, "packed-refs")]
+        for (dirpath, dirnames, filenames) in os.walk(os.path.join(self.gitdir, "refs")):
+            paths.extend(os.path.join(dirpath, name) for name in filenames)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # removed while we were looking
+                continue
+            result.append((path, st.st_mtime_ns, st.st_size))
+        result.sort()
+        return result
+
+    # have any refs changed since the last call (or since we started)?
+    def changed(self):
+        current = self.scan()
+        if current == self.last:
+            return False
+        self.last = current
+        return True
@@ -12,6 +12,10 @@ from timeit import default_timer as timer
 import re
 from pprint import pprint
 import datetime
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import instrument
 
 repobase = zuzserver.getRepobase()
 
@@ -24,7 +28,9 @@ parser.add_argument('-e', '--encrypt', action="store_true", help="encrypt")
 parser.add_argument('-s', '--specfile', default=".encrypt", help="file with encryption files relative to repo root")
 parser.add_argument('-k', '--keyfile', default=".repokeys", help="file with keys relative to repo root")
 parser.add_argument('files', nargs="*", help="specific files to operate on")
+instrument.addArguments(parser)
 args = parser.parse_args()
+instrument.fromArguments(args)
 verbose = args.verbose
 doall = args.allfiles
 replace = args.replace
@@ -82,6 +88,8 @@ def parseSpecfile(specfile):
 
 
 def encryptAndReplace(plain, secret, keyspec):
+    # deriving a key is by far the slowest part, so it is only done once per key
+    instrument.hits("derived keys", keyspec["derived"] is not None, keyspec["derived"] is None)
     if keyspec["derived"] is None:
         password = keyspec["password"]
         print("password", password)
@@ -94,7 +102,8 @@ def encryptAndReplace(plain, secret, keyspec):
             salt=salt,
             iterations=480000,
         )
-        derived = kdf.derive(bytes(password, 'utf-8'))
+        with instrument.phase("derive key"):
+            derived = kdf.derive(bytes(password, 'utf-8'))
         keyspec["derived"] = derived
         end = timer()
         print("kdf derived", derived, end-start)
@@ -105,12 +114,13 @@ def encryptAndReplace(plain, secret, keyspec):
     f = keyspec["fernet"]
     plainpath = plain
     secretpath = secret
-    with open(plainpath, "rb") as plainfile:
-        with open(secretpath, "wb") as secretfile:
-            for line in plainfile:
-                secretline = f.encrypt(line)
-                secretfile.write(secretline)
-                secretfile.write(b"\n")
+    with instrument.phase("encrypt file"):
+        with open(plainpath, "rb") as plainfile:
+            with open(secretpath, "wb") as secretfile:
+                for line in plainfile:
+                    secretline = f.encrypt(line)
+                    secretfile.write(secretline)
+                    secretfile.write(b"\n")
 
 
 def checkAndEncrypt(filepath, keylist, tocommit):
@@ -194,7 +204,8 @@ else:
         maybefile = os.path.join(repobase, specfile)
         if not os.path.isfile(maybefile):
             error("{}: Could not find specfile or in {}".format(specfile, maybefile))
-    files = parseSpecfile(maybefile)
+    with instrument.phase("find files"):
+        files = parseSpecfile(maybefile)
 pprint(files)
 
 # get keys
@@ -216,8 +227,9 @@ pprint(keylist)
 if encrypt:
     # look for files that need to be committed
     tocommit = []
-    for file in files:
-        checkAndEncrypt(file, keylist, tocommit)
+    with instrument.phase("encrypt"):
+        for file in files:
+            checkAndEncrypt(file, keylist, tocommit)
     if len(tocommit) > 0:
         # some of the files changed, so exit -1
         print("There are {} secret files that changed".format(len(tocommit)))
@@ -228,8 +240,9 @@ if decrypt:
     # see if any secret files are newer than plain files.  Before we
     # decrypt make sure plain files haven't been changed
     changed = []
-    for file in files:
-        checkAndDecrypt(file, keylist, changed, replace)
+    with instrument.phase("decrypt"):
+        for file in files:
+            checkAndDecrypt(file, keylist, changed, replace)
     if len(changed) > 0:
         print("There are {} plaintext files that {}changed".format(len(changed), "need to be " if replace else ""))
     exit(0)
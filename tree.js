@@ -1,4 +1,30 @@
+// tree.html only holds the top of the tree.  Branch diffs and the
+// deeper subtrees are in tree-data/*.js shards which bgraph.py writes
+// next to it.  A shard is loaded the first time something in it is
+// needed, and calls treeData() with its records.
+
 let diffdiv = null;
+const shards = {};
+const records = {d: {}, t: {}};
+
+function treeData(kind, data) {
+    Object.assign(records[kind], data);
+}
+
+// load shard number shard of kind ('d' for diffs, 't' for subtrees)
+function loadShard(kind, shard) {
+    const name = `${kind}${shard}`;
+    if (!(name in shards)) {
+        shards[name] = new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = `tree-data/${name}.js`;
+            script.onload = resolve;
+            script.onerror = reject;
+            document.head.appendChild(script);
+        });
+    }
+    return shards[name];
+}
 
 function hideme(event) {
     if (diffdiv != null) {
@@ -7,25 +33,57 @@ function hideme(event) {
     }
 }
 
-function showDiff(event) {
+async function showDiff(event) {
     if (diffdiv != null)
         diffdiv.style.display = 'none';
 
     const target = event.target;
     const diff = `diff-${target.id}`;
-    const elem = document.getElementById(diff);
+    let elem = document.getElementById(diff);
+    if (elem == null) {
+        await loadShard('d', target.dataset.shard);
+        elem = document.createElement('div');
+        elem.id = diff;
+        elem.className = 'diffs';
+        elem.innerHTML = records.d[target.id];
+        document.body.appendChild(elem);
+    }
     elem.style.display = 'block';
     diffdiv = elem;
+}
+
+// expand or collapse the children of the node the toggle belongs to,
+// loading them first if they aren't in the page yet
+async function toggleSubtree(event) {
+    const target = event.target;
+    const li = target.parentElement;
+    const ul = li.querySelector(':scope > ul');
+    if (ul == null) {
+        await loadShard('t', target.dataset.shard);
+        li.insertAdjacentHTML('beforeend', records.t[target.dataset.subtree]);
+        delete records.t[target.dataset.subtree];
+        target.textContent = '-';
+        return;
+    }
+    const hidden = ul.style.display == 'none';
+    ul.style.display = hidden ? '' : 'none';
+    target.textContent = hidden ? '-' : '+';
+}
+
+// one handler for the whole page, so it also covers subtrees added later
+function click(event) {
+    const classes = event.target.classList;
+    if (classes.contains('branch'))
+        showDiff(event);
+    else if (classes.contains('toggle'))
+        toggleSubtree(event);
+    else
+        return hideme(event);
 
     event.stopPropagation();
     event.preventDefault();
 }
 
 function initialize() {
-    let branches = document.getElementsByClassName('branch');
-
-    for (const element of branches)
-        element.addEventListener('click', showDiff);
-
-    document.getElementsByTagName('body')[0].addEventListener('click', hideme);
+    document.getElementsByTagName('body')[0].addEventListener('click', click);
 }
@@ -0,0 +1,60 @@
+# Serve what bgraph writes (tree.html, tree.css, tree.js and
+# tree-data/) on localhost, plus the latest export as /graph.jsonl, so
+# a page or a script can pick up a refresh without rerunning bgraph.
+# Those live next to the scripts, so nothing else in the directory is
+# served.
+
+import http.server
+import re
+import threading
+import urllib.parse
+
+SERVED = re.compile(r"^/(tree\.html|tree\.css|tree\.js|tree-data/[\w.-]+)$")
+
+
+class TreeServer:
+
+    def __init__(self, port, directory):
+        self.export = b""
+        server = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+
+            def __init__(self, *args, **kwargs):
+                http.server.SimpleHTTPRequestHandler.__init__(self, *args, directory=directory, **kwargs)
+
+            def do_GET(self):
+                path = urllib.parse.urlparse(self.path).path
+                if path == "/":
+                    self.path = path = "/tree.html"
+                if path != "/graph.jsonl":
+                    if not self.allowed():
+                        return self.send_error(404)
+                    return http.server.SimpleHTTPRequestHandler.do_GET(self)
+                data = server.export
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_HEAD(self):
+                if not self.allowed():
+                    return self.send_error(404)
+                return http.server.SimpleHTTPRequestHandler.do_HEAD(self)
+
+            def allowed(self):
+                path = urllib.parse.urlparse(self.path).path
+                return SERVED.match(path) is not None and ".." not in path
+
+            def end_headers(self):
+                # everything here changes on every refresh
+                self.send_header("Cache-Control", "no-store")
+                http.server.SimpleHTTPRequestHandler.end_headers(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()